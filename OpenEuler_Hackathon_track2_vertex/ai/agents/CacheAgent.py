@@ -1,10 +1,29 @@
 import sys
+import numpy as np
 
 # Abstract class
 class CacheAgent(object):
+    # Observation fields the agent reads, passed to Cache.reset() so that
+    # other fields are only computed on demand. None means every field.
+    required_fields = None
+
     def __init__(self, n_actions): pass
     def choose_action(self, observation): pass
     def store_transition(self, s, a, r, s_): pass
+
+    # Batched versions for observations stacked by VectorCache.
+    # Agents that can do better than one call per row override these.
+    def choose_actions(self, observations):
+        return np.array([self.choose_action(o) for o in CacheAgent._rows(observations)], dtype=int)
+
+    def store_transitions(self, s, a, r, s_):
+        for i, (o, o_) in enumerate(zip(CacheAgent._rows(s), CacheAgent._rows(s_))):
+            self.store_transition(o, a[i], r[i], o_)
+
+    @staticmethod
+    def _rows(observations):
+        n = len(next(iter(observations.values())))
+        return [{key: value[i] for key, value in observations.items()} for i in range(n)]
     
 class ReflexAgent(CacheAgent):
     def __init__(self, n_actions): pass
@@ -14,4 +33,4 @@ class ReflexAgent(CacheAgent):
 
 class LearnerAgent(CacheAgent):
     def __init__(self, n_actions): pass
-    def learn(self): pass
\ No newline at end of file
+    def learn(self): pass
@@ -22,6 +22,67 @@ tf.set_random_seed(1)
 # disable eager execution
 tf.disable_eager_execution()
 
+# Binary tree whose leaves are the priorities of the replay memory slots and
+# whose inner nodes are the sums of their children, so that sampling slots in
+# proportion to their priority and updating priorities take O(log n).
+# Node i has children 2i+1 and 2i+2, and slot j is leaf capacity - 1 + j.
+class SumTree(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tree = np.zeros(2 * capacity - 1)
+        # Highest priority ever set, kept up to date by update()
+        self.max = 0.
+
+    def total(self):
+        return self.tree[0]
+
+    def max_priority(self):
+        return self.max
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.capacity - 1]
+
+    # Set the priorities of slots, then the sums up to the root level by level
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.capacity - 1
+        self.tree[nodes] = priorities
+        if np.size(priorities) > 0:
+            self.max = max(self.max, float(np.max(priorities)))
+        nodes = nodes[nodes > 0]
+        while len(nodes) > 0:
+            nodes = np.unique((nodes - 1) // 2)
+            self.tree[nodes] = self.tree[2 * nodes + 1] + self.tree[2 * nodes + 2]
+            nodes = nodes[nodes > 0]
+
+    # Same as update() for a single slot, e.g. a new transition: a plain walk
+    # up the tree is much cheaper than the vectorized levels.
+    def set(self, index, priority):
+        tree = self.tree
+        node = index + self.capacity - 1
+        tree[node] = priority
+        if priority > self.max:
+            self.max = priority
+        while node > 0:
+            node = (node - 1) // 2
+            tree[node] = tree[2 * node + 1] + tree[2 * node + 2]
+
+    # Slots where the cumulative priority reaches each of `values`
+    def find(self, values):
+        values = np.array(values, dtype=np.float64)
+        nodes = np.zeros(len(values), dtype=np.int64)
+        while True:
+            inner = 2 * nodes + 1 < len(self.tree)
+            if not inner.any():
+                break
+            left = 2 * nodes[inner] + 1
+            value = values[inner]
+            # Never into a subtree without priority, even when rounding
+            # pushes a value past the total of a node
+            go_left = (value < self.tree[left]) | (self.tree[left + 1] == 0)
+            values[inner] = np.where(go_left, value, value - self.tree[left])
+            nodes[inner] = np.where(go_left, left, left + 1)
+        return nodes - (self.capacity - 1)
+
 # Deep Q Network
 class DQNAgent(LearnerAgent):
     def __init__(
@@ -49,6 +110,22 @@ class DQNAgent(LearnerAgent):
         memory_size=500,
         batch_size=32,
 
+        # learn() steps between refreshes of the NumPy copy of the eval net
+        weights_refresh_iter=1,
+
+        # Prioritized experience replay (Schaul et al. 2016): transitions are
+        # sampled with probability priority^alpha, priority being the TD error,
+        # and weighted by importance sampling with beta annealed to 1.
+        # per_abs_err_upper clips the TD errors, leave None to keep them: our
+        # rewards are hit counts, far above 1, so a clip at 1 makes every
+        # priority equal.
+        prioritized=False,
+        per_alpha=0.6,
+        per_beta=0.4,
+        per_beta_increment=0.001,
+        per_epsilon=0.01,
+        per_abs_err_upper=None,
+
         output_graph=False,
         verbose=0
     ):
@@ -72,6 +149,9 @@ class DQNAgent(LearnerAgent):
             self.explore_mentor = LRUAgent
         elif explore_mentor.upper() == 'LFU':
             self.explore_mentor = LFUAgent
+        self.required_fields = ('features',)
+        if self.explore_mentor is not None:
+            self.required_fields += self.explore_mentor.required_fields
         
         self.replace_target_iter = replace_target_iter
         self.memory_size = memory_size
@@ -82,6 +162,16 @@ class DQNAgent(LearnerAgent):
         # initialize zero memory [s, a, r, s_]
         self.memory = np.zeros((self.memory_size, n_features * 2 + 2))
         self.memory_counter = 0
+
+        # priorities of the memory slots
+        self.prioritized = prioritized
+        if self.prioritized:
+            self.priorities = SumTree(self.memory_size)
+            self.per_alpha = per_alpha
+            self.per_beta = per_beta
+            self.per_beta_increment = per_beta_increment
+            self.per_epsilon = per_epsilon
+            self.per_abs_err_upper = per_abs_err_upper
         
         # initialize a history set for rewards
         self.reward_history = []
@@ -94,6 +184,9 @@ class DQNAgent(LearnerAgent):
         t_params = tf.get_collection('target_net_params')
         e_params = tf.get_collection('eval_net_params')
         self.replace_target_op = [tf.assign(t, e) for t, e in zip(t_params, e_params)]
+        # w1, b1, w2, b2, w3, b3 of the eval net
+        self.eval_params = e_params
+        self.weights_refresh_iter = weights_refresh_iter
 
         self.sess = tf.Session()
 
@@ -103,6 +196,7 @@ class DQNAgent(LearnerAgent):
             tf.summary.FileWriter("logs/", self.sess.graph)
 
         self.sess.run(tf.global_variables_initializer())
+        self._refresh_weights()
         self.cost_his = []
         
         self.verbose = verbose
@@ -138,7 +232,12 @@ class DQNAgent(LearnerAgent):
                 self.q_eval = tf.matmul(l2, w3) + b3
 
         with tf.variable_scope('loss'):
-            self.loss = tf.reduce_mean(tf.squared_difference(self.q_target, self.q_eval))
+            if self.prioritized:
+                # importance-sampling weights of the batch
+                self.is_weights = tf.placeholder(tf.float32, [None, 1], name='IS_weights')
+                self.loss = tf.reduce_mean(self.is_weights * tf.squared_difference(self.q_target, self.q_eval))
+            else:
+                self.loss = tf.reduce_mean(tf.squared_difference(self.q_target, self.q_eval))
         with tf.variable_scope('train'):
             self._train_op = tf.train.RMSPropOptimizer(self.lr).minimize(self.loss)
 
@@ -174,12 +273,29 @@ class DQNAgent(LearnerAgent):
         index = self.memory_counter % self.memory_size
         self.memory[index, :] = transition
         self.memory_counter += 1
+        if self.prioritized:
+            self.priorities.set(index, self._new_priority())
         
         # Record reward
         if len(self.reward_history) == self.history_size:
             self.reward_history.pop(0)
         self.reward_history.append(r)
 
+    # Batched store_transition for observations stacked by VectorCache
+    def store_transitions(self, s, a, r, s_):
+        s, s_ = s['features'], s_['features']
+        n = len(s)
+        transitions = np.hstack((s, np.asarray(a)[:, np.newaxis], np.asarray(r)[:, np.newaxis], s_))
+
+        index = (self.memory_counter + np.arange(n)) % self.memory_size
+        self.memory[index, :] = transitions
+        self.memory_counter += n
+        if self.prioritized:
+            self.priorities.update(index, self._new_priority())
+
+        self.reward_history.extend(r)
+        del self.reward_history[:-self.history_size]
+
     def choose_action(self, observation):
         # draw probability sample
         coin = np.random.uniform()
@@ -193,7 +309,7 @@ class DQNAgent(LearnerAgent):
             observation = observation[np.newaxis, :]
 
             # forward feed the observation and get q value for every actions
-            actions_value = self.sess.run(self.q_eval, feed_dict={self.s: observation})
+            actions_value = self._q_values(observation)
             action = np.argmax(actions_value)
             
         if action < 0 or action > self.n_actions:
@@ -201,6 +317,62 @@ class DQNAgent(LearnerAgent):
             
         return action
 
+    # Batched choose_action: one forward pass serves every greedy row.
+    def choose_actions(self, observations):
+        n = len(observations['features'])
+        actions = np.zeros(n, dtype=int)
+
+        coins = np.random.uniform(size=n)
+        explore = coins < self.epsilons[0]
+        mentor = ~explore & (coins < self.epsilons[0] + self.epsilons[1])
+        greedy = ~explore & ~mentor
+
+        for i in np.flatnonzero(explore):
+            actions[i] = RandomAgent._choose_action(self.n_actions)
+        for i in np.flatnonzero(mentor):
+            actions[i] = self.explore_mentor._choose_action(
+                {key: value[i] for key, value in observations.items()})
+        if greedy.any():
+            actions_value = self._q_values(observations['features'][greedy])
+            actions[greedy] = np.argmax(actions_value, axis=1)
+
+        return actions
+
+    # Copy the eval net weights out of the session, for _q_values()
+    def _refresh_weights(self):
+        self.eval_weights = self.sess.run(self.eval_params)
+
+    # Q values of the eval net, computed in NumPy from the copied weights,
+    # which saves a session run per decision
+    def _q_values(self, features):
+        w1, b1, w2, b2, w3, b3 = self.eval_weights
+        l1 = np.maximum(np.dot(np.asarray(features, dtype=np.float32), w1) + b1, 0)
+        l2 = np.maximum(np.dot(l1, w2) + b2, 0)
+        return np.dot(l2, w3) + b3
+
+    # New transitions get the highest priority so far, to be replayed at
+    # least once
+    def _new_priority(self):
+        priority = self.priorities.max_priority()
+        if priority == 0:
+            priority = (self.per_abs_err_upper or 1.) ** self.per_alpha
+        return priority
+
+    # Memory slots sampled in proportion to their priority, one per equal
+    # segment of the total priority, with their importance-sampling weights
+    def _sample_prioritized(self):
+        n = min(self.memory_counter, self.memory_size)
+        total = self.priorities.total()
+        segment = total / self.batch_size
+        values = (np.arange(self.batch_size) + np.random.uniform(size=self.batch_size)) * segment
+        sample_index = self.priorities.find(values)
+
+        self.per_beta = min(1., self.per_beta + self.per_beta_increment)
+        probabilities = self.priorities.get(sample_index) / total
+        is_weights = np.power(n * probabilities, -self.per_beta)
+        is_weights /= is_weights.max()
+        return sample_index, is_weights[:, np.newaxis]
+
     def learn(self):
         # check to replace target parameters
         if self.learn_step_counter % self.replace_target_iter == 0:
@@ -210,7 +382,9 @@ class DQNAgent(LearnerAgent):
                 print('Target DQN params replaced')
 
         # sample batch memory from all memory
-        if self.memory_counter > self.memory_size:
+        if self.prioritized:
+            sample_index, is_weights = self._sample_prioritized()
+        elif self.memory_counter > self.memory_size:
             sample_index = np.random.choice(self.memory_size, size=self.batch_size)
         else:
             sample_index = np.random.choice(self.memory_counter, size=self.batch_size)
@@ -259,10 +433,19 @@ class DQNAgent(LearnerAgent):
         """
 
         # train eval network
-        _, self.cost = self.sess.run([self._train_op, self.loss],
-            feed_dict={self.s: batch_memory[:, :self.n_features], self.q_target: q_target}
-        )
+        feed_dict = {self.s: batch_memory[:, :self.n_features], self.q_target: q_target}
+        if self.prioritized:
+            feed_dict[self.is_weights] = is_weights
+            # new priorities from the TD errors of the sampled transitions
+            abs_errors = np.abs(q_target[batch_index, eval_act_index] - q_eval[batch_index, eval_act_index])
+            abs_errors = abs_errors + self.per_epsilon
+            if self.per_abs_err_upper is not None:
+                abs_errors = np.minimum(abs_errors, self.per_abs_err_upper)
+            self.priorities.update(sample_index, np.power(abs_errors, self.per_alpha))
+        _, self.cost = self.sess.run([self._train_op, self.loss], feed_dict=feed_dict)
         self.cost_his.append(self.cost)
+        if self.learn_step_counter % self.weights_refresh_iter == 0:
+            self._refresh_weights()
         # verbose                    
         if (self.verbose == 2 and self.learn_step_counter % 100 == 0) or \
             (self.verbose >= 3 and self.learn_step_counter % 20 == 0):
@@ -3,6 +3,8 @@ import numpy as np
 from agents.CacheAgent import ReflexAgent
 
 class RandomAgent(ReflexAgent):
+    required_fields = ()
+
     def __init__(self, n_actions):
         self.n_actions = n_actions
 
@@ -14,6 +16,8 @@ class RandomAgent(ReflexAgent):
         return RandomAgent._choose_action(self.n_actions)
 
 class LRUAgent(ReflexAgent):
+    required_fields = ('last_used_times',)
+
     def __init__(self, n_actions):
         self.n_actions = n_actions
 
@@ -30,6 +34,8 @@ class LRUAgent(ReflexAgent):
         return min_idx
 
 class MRUAgent(ReflexAgent):
+    required_fields = ('last_used_times',)
+
     def __init__(self, n_actions):
         self.n_actions = n_actions
 
@@ -46,6 +52,8 @@ class MRUAgent(ReflexAgent):
         return max_idx
 
 class LFUAgent(ReflexAgent):
+    required_fields = ('total_use_frequency',)
+
     def __init__(self, n_actions):
         self.n_actions = n_actions
         
@@ -60,3 +68,22 @@ class LFUAgent(ReflexAgent):
         if min_idx < 0 or min_idx > self.n_actions:
             raise ValueError("LFUAgent: Error index %d" % max_idx)
         return min_idx
+
+class BeladyAgent(ReflexAgent):
+    required_fields = ('next_use_times',)
+
+    def __init__(self, n_actions):
+        self.n_actions = n_actions
+
+    # Evict the resource whose next request is the farthest in the future (OPT).
+    @staticmethod
+    def _choose_action(observation):
+        next_use_times = np.array(observation['next_use_times'])
+        max_idx = np.argmax(next_use_times)
+        return max_idx
+
+    def choose_action(self, observation):
+        max_idx = BeladyAgent._choose_action(observation)
+        if max_idx < 0 or max_idx > self.n_actions:
+            raise ValueError("BeladyAgent: Error index %d" % max_idx)
+        return max_idx
@@ -0,0 +1,165 @@
+import sys, os, re
+import numpy as np
+from cache.DataLoader import DataLoader, TRACE_DTYPE
+
+# Block-level traces from Linux block layer tools, as (block, operation)
+# requests with blocks of `block_size` bytes. Operations follow the
+# blocksector CSVs: 1 for read, 0 for write.
+
+SECTOR_SIZE = 512
+# Text read and parsed at a time, in bytes
+READ_SIZE = 1 << 26
+
+# Lines of a text file matching `pattern`, as a list of group tuples. The
+# file is scanned in large pieces cut at line ends.
+def _findall(path, pattern):
+    matches = []
+    with open(path) as f:
+        rest = ''
+        while True:
+            text = f.read(READ_SIZE)
+            if not text:
+                break
+            text = rest + text
+            end = text.rfind('\n') + 1
+            matches += pattern.findall(text, 0, end)
+            rest = text[end:]
+        matches += pattern.findall(rest)
+    return matches
+
+# Blocks covered by the byte ranges [start, end), in order. Empty ranges
+# give no block.
+def _blocks(start, end, block_size):
+    first = start // block_size
+    lengths = np.where(end > start, (end - 1) // block_size - first + 1, 0)
+    # first[i], first[i] + 1, ... for every range i
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(first, lengths) + offsets, lengths
+
+# Requests of a blkparse text dump (blkparse -i <trace>), one per block
+# touched by every event of the given actions, by default Q (queued, before
+# any merge). Events without read or write data (flushes, discards) and
+# other lines (notes, summaries) are skipped.
+def parse_blkparse(path, block_size=4096, actions=('Q',)):
+    # dev cpu seq time pid action RWBS sector + size [process]. Matching
+    # from the action on is much faster than anchoring every line.
+    pattern = re.compile(r'\s(?:%s)\s+([A-Z]+)\s+(\d+)\s+\+\s+(\d+)'
+        % '|'.join(re.escape(action) for action in actions))
+    matches = _findall(path, pattern)
+    if not matches:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+
+    rwbs, sectors, sizes = np.array(matches).T
+    writes = np.char.find(rwbs, 'W') >= 0
+    reads = np.char.find(rwbs, 'R') >= 0
+    keep = writes | reads
+    start = sectors[keep].astype(np.int64) * SECTOR_SIZE
+    end = start + sizes[keep].astype(np.int64) * SECTOR_SIZE
+    blocks, lengths = _blocks(start, end, block_size)
+    operations = np.repeat(np.where(writes[keep], 0, 1).astype(np.uint8), lengths)
+    return blocks, operations
+
+# Requests of periodic /proc/diskstats snapshots of `device`, concatenated
+# in one file; other lines are ignored. By default the device with the most
+# sectors transferred. diskstats only counts sectors, so the sectors read and
+# written in every interval are addressed at their cumulative position since
+# the first snapshot, like dataPreprocessing.convert_with_cumulative_sectors,
+# reads then writes. Writes are addressed after all the reads, from the next
+# block on, so that no write lands on a block read before. The trace has the
+# real volume of the I/O, not its locality.
+def parse_diskstats(path, device=None, block_size=4096):
+    # major minor name reads merged sectors_read ms writes merged sectors_written
+    pattern = re.compile(r'^\s*\d+\s+\d+\s+(\S+)\s+\d+\s+\d+\s+(\d+)\s+\d+\s+\d+\s+\d+\s+(\d+)', re.MULTILINE)
+    matches = _findall(path, pattern)
+    if not matches:
+        raise ValueError("No diskstats line in %s." % path)
+
+    names, sectors_read, sectors_written = np.array(matches).T
+    sectors = np.stack((sectors_read.astype(np.int64), sectors_written.astype(np.int64)), axis=1)
+    if device is None:
+        devices, inverse = np.unique(names, return_inverse=True)
+        # Counters grow, so the largest counts are of the busiest device
+        totals = np.zeros(len(devices), dtype=np.int64)
+        np.maximum.at(totals, inverse, sectors.sum(axis=1))
+        device = devices[np.argmax(totals)]
+    sectors = sectors[names == device]
+    if len(sectors) == 0:
+        raise ValueError("No diskstats of device %s in %s." % (device, path))
+
+    # Cumulative sectors since the first snapshot, counter resets dropped
+    transferred = np.maximum(np.diff(sectors, axis=0), 0)
+    cumulative = np.vstack((np.zeros((1, 2), dtype=np.int64), np.cumsum(transferred, axis=0)))
+    # Interleaved read and write ranges of every interval, in bytes
+    cumulative *= SECTOR_SIZE
+    cumulative[:, 1] += -(-cumulative[-1, 0] // block_size) * block_size
+    start = cumulative[:-1].reshape(-1)
+    end = cumulative[1:].reshape(-1)
+    blocks, lengths = _blocks(start, end, block_size)
+    operations = np.repeat(np.tile(np.array([1, 0], dtype=np.uint8), len(transferred)), lengths)
+    return blocks, operations
+
+# Save requests as a binary trace that DataLoaderPintos loads. Every row is
+# flagged boot/exec 1, which DataLoaderPintos keeps by default.
+def save_trace(path, blocks, operations):
+    trace = np.empty(len(blocks), dtype=TRACE_DTYPE)
+    trace['blocksector'] = blocks
+    trace['read/write'] = operations
+    trace['boot/exec'] = 1
+    np.save(path, trace)
+
+class DataLoaderBlockTrace(DataLoader):
+    def __init__(self, blocks, operations):
+        super(DataLoaderBlockTrace, self).__init__()
+        # Remap blocks to dense ids, stored as int32
+        self.resources, requests = np.unique(blocks, return_inverse=True)
+        self.requests = requests.astype(np.int32)
+        self.operations = np.asarray(operations, dtype=np.uint8)
+
+    def get_requests(self):
+        return self.requests
+
+    def get_operations(self):
+        return self.operations
+
+class DataLoaderBlkparse(DataLoaderBlockTrace):
+    def __init__(self, path, block_size=4096, actions=('Q',)):
+        super(DataLoaderBlkparse, self).__init__(*parse_blkparse(path, block_size, actions))
+
+class DataLoaderDiskstats(DataLoaderBlockTrace):
+    def __init__(self, path, device=None, block_size=4096):
+        super(DataLoaderDiskstats, self).__init__(*parse_diskstats(path, device, block_size))
+
+# Captured samples in cache/samples and their requests at 4096-byte blocks,
+# worked out by hand: the queued reads and writes of blkparse.txt, skipping
+# its flush, discard, merge, note and summary lines, and the intervals of sda
+# in diskstats.txt, reads from block 0 and writes after them.
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+SAMPLES = dict(
+    blkparse=([256, 2, 3, 4, 512, 513, 2], [0, 1, 1, 1, 1, 0, 1]),
+    diskstats=([0, 1, 6, 7, 8, 9, 2, 3, 4, 5], [1, 1, 0, 0, 0, 0, 1, 1, 1, 1]),
+)
+
+# Parse the samples and compare with their expected requests.
+def check_samples():
+    parsers = dict(blkparse=parse_blkparse, diskstats=parse_diskstats)
+    for name, (blocks, operations) in SAMPLES.items():
+        parsed = parsers[name](os.path.join(SAMPLES_DIR, name + '.txt'), block_size=4096)
+        if parsed[0].tolist() != blocks or parsed[1].tolist() != operations:
+            raise ValueError("Sample %s parsed to %s, expected %s."
+                % (name, [p.tolist() for p in parsed], [blocks, operations]))
+        print("Sample %s: %d requests OK" % (name, len(blocks)))
+
+
+# Usage: python -m cache.BlockTrace blkparse|diskstats input.txt output.npy [block_size]
+#        python -m cache.BlockTrace check
+if __name__ == "__main__":
+    if sys.argv[1] == 'check':
+        check_samples()
+        sys.exit(0)
+    block_size = int(sys.argv[4]) if len(sys.argv) > 4 else 4096
+    if sys.argv[1] == 'blkparse':
+        blocks, operations = parse_blkparse(sys.argv[2], block_size)
+    else:
+        blocks, operations = parse_diskstats(sys.argv[2], block_size=block_size)
+    save_trace(sys.argv[3], blocks, operations)
+    print("Saved %d requests on %d blocks to %s" % (len(blocks), len(np.unique(blocks)), sys.argv[3]))
@@ -1,6 +1,52 @@
-import sys, os, random
+import sys, os, random, time
+from bisect import bisect_right
 import numpy as np
+from collections import defaultdict
+from collections.abc import Mapping
 from cache.DataLoader import *
+
+# Smallest integer type holding the indexes of a trace of n requests
+def index_dtype(n):
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+# next_use[i] is the index of the next request on requests[i] after i,
+# or len(requests) if it is never requested again.
+def next_use_index(requests):
+    requests = np.asarray(requests)
+    n = len(requests)
+    next_use = np.full(n, n, dtype=index_dtype(n))
+    if n == 0:
+        return next_use
+    # Equal requests are adjacent and in trace order after a stable sort
+    order = np.argsort(requests, kind='stable')
+    same = requests[order[1:]] == requests[order[:-1]]
+    next_use[order[:-1][same]] = order[1:][same]
+    return next_use
+
+# Run-length encoding of a trace: the resource and length of every run of
+# consecutive requests on the same resource.
+def run_length_encode(requests):
+    requests = np.asarray(requests)
+    if len(requests) == 0:
+        return requests[:0], np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], requests[1:] != requests[:-1])))
+    lengths = np.diff(np.append(starts, len(requests)))
+    return requests[starts], lengths
+
+# Requests sorted by (resource id, index), encoded as id * n + index, so the
+# requests on a resource within [start, end) are the keys between
+# id * n + start and id * n + end. rank[i] is the position of request i in
+# the sorted keys, and the id of a resource is its position in the sorted
+# `resources`.
+def occurrence_index(requests):
+    requests = np.asarray(requests)
+    n = len(requests)
+    resources, inverse = np.unique(requests, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    keys = inverse[order].astype(np.int64) * n + order
+    rank = np.empty(n, dtype=index_dtype(n))
+    rank[order] = np.arange(n)
+    return keys, rank, resources
                     
 class Cache(object):
     def __init__(self, requests, cache_size
@@ -16,6 +62,9 @@ class Cache(object):
         # leave none for random read/writes
         , operations=None
         , allow_skip=False
+
+        # Record calls and wall time of the simulator phases, see profile()
+        , profiling=False
     ):
         # If the cache allows skip eviction
         # Network caching, disk caching do allow skipping eviction and grab resource directly.
@@ -28,37 +77,62 @@ class Cache(object):
         self.evict_count = 0
 
         # Load requests
-        if isinstance(requests, DataLoader):   # From data loader
-            self.requests = requests.get_requests()
-            self.operations = requests.get_operations()
-        else:                                   # From array
-            self.requests = requests
-            self.operations = operations
-            # random read/writes
-            if self.operations is None:
-                self.operations = [random.randint(0, 1) for i in range(len(self.requests))]
+        resources = self._load_requests(requests, operations, cache_size)
         self.cur_index = -1
 
-        if len(self.requests) <= cache_size:
-            raise ValueError("The count of requests are too small. Try larger one.")
-
-        if len(self.requests) != len(self.operations):
-            raise ValueError("Not every request is assigned with an operation.")
+        # Start index of every program of a multi-program trace, see
+        # DataLoaderPintos.offsets, and the misses of the episode in each
+        offsets = getattr(requests, 'offsets', None) if isinstance(requests, DataLoader) else None
+        self.program_offsets = [0] if offsets is None else [int(offset) for offset in offsets[:-1]]
+        self.program_misses = [0] * len(self.program_offsets)
         
         # Important: Reward function
         self.reward_params = reward_params
         
         # Elasped terms - short, middle and long
         self.FEAT_TREMS = terms
+        # Sliding-window request counters for each term, see _sync_windows()
+        self.window_counts = {t: {} for t in self.FEAT_TREMS}
+        self.window_end = 0
 
-        # Cache
+        # Cache, preallocated and updated in place
         self.cache_size = cache_size
-        self.slots = [-1] * self.cache_size
-        self.used_times = [-1] * self.cache_size
-        self.cached_times = [-1] * self.cache_size
-        self.access_bits = [False] * self.cache_size
-        self.dirty_bits = [False] * self.cache_size
-        self.resource_freq = {}
+        self.slots = np.full(self.cache_size, -1, dtype=np.int64)
+        self.used_times = np.full(self.cache_size, -1, dtype=np.int64)
+        self.cached_times = np.full(self.cache_size, -1, dtype=np.int64)
+        self.access_bits = np.zeros(self.cache_size, dtype=bool)
+        self.dirty_bits = np.zeros(self.cache_size, dtype=bool)
+        # Total requests per resource, a table indexed by id for dense ids
+        if resources is not None:
+            self.resource_freq = [0] * len(resources)
+        else:
+            self.resource_freq = defaultdict(int)
+
+        # Read-only views of the cache state handed out in observations
+        self.state_views = {}
+        for name, state in [('cache_state', self.slots), ('cached_times', self.cached_times),
+                ('last_used_times', self.used_times), ('access_bits', self.access_bits),
+                ('dirty_bits', self.dirty_bits)]:
+            view = state.view()
+            view.flags.writeable = False
+            self.state_views[name] = view
+        # Bumped whenever the state changes, to detect stale observations
+        self.epoch = 0
+        self.episode = 0
+
+        self.profiling = profiling
+        if self.profiling:
+            self._enable_profiling()
+
+        # Observation fields computed per decision epoch. Only the required
+        # ones are computed eagerly, the rest on first access, see reset().
+        self.computed_fields = dict(features=self._get_features,
+            next_use_times=self._get_next_use_times,
+            total_use_frequency=self._get_use_frequency
+        )
+        self.required_fields = None
+        # Resource -> slot id of every cached resource, kept in sync with slots
+        self.resource_slots = {}
 
         # Action & feature information
         self.sel_features = feature_selection
@@ -72,6 +146,95 @@ class Cache(object):
             self.n_features += self.cache_size
 
 
+    # Load the trace and build its indexes. Returns the dense id -> resource
+    # map if the requests are dense ids, otherwise None.
+    def _load_requests(self, requests, operations, cache_size):
+        if isinstance(requests, DataLoader):   # From data loader
+            self.requests = as_sequence(requests.get_requests())
+            self.operations = as_sequence(requests.get_operations())
+            resources = requests.get_resources()
+        else:                                   # From array
+            self.requests = as_sequence(requests)
+            self.operations = as_sequence(operations)
+            resources = None
+            # random read/writes
+            if self.operations is None:
+                self.operations = [random.randint(0, 1) for i in range(len(self.requests))]
+
+        if len(self.requests) <= cache_size:
+            raise ValueError("The count of requests are too small. Try larger one.")
+
+        if len(self.requests) != len(self.operations):
+            raise ValueError("Not every request is assigned with an operation.")
+
+        # The indexes are kept as NumPy arrays, read through as_sequence()
+        # like the trace: a few bytes per request instead of a Python list.
+        n_requests = len(self.requests)
+        # Index of the next request on the same resource, for every request
+        self.next_use = as_sequence(next_use_index(self.requests))
+        # Per-resource request counts over any span, for the rewards
+        self.use_keys, use_rank, self.use_resources = occurrence_index(self.requests)
+        self.use_rank = as_sequence(use_rank)
+        # Runs of repeated requests, for _run_until_miss(): the start of every
+        # run followed by the trace length, and the last write in every run,
+        # -1 if none. run_cursor is the run of the last miss, None after
+        # cur_index moved otherwise (reset, restore).
+        _, lengths = run_length_encode(self.requests)
+        self.run_starts = np.zeros(len(lengths) + 1, dtype=index_dtype(n_requests))
+        np.cumsum(lengths, out=self.run_starts[1:])
+        writes = np.flatnonzero(np.asarray(self.operations) == 1)
+        runs = np.searchsorted(self.run_starts, writes, side='right') - 1
+        run_last_write = np.full(len(lengths), -1, dtype=index_dtype(n_requests))
+        # Writes are in order, so the last one of each run wins
+        run_last_write[runs] = writes
+        self.run_starts = as_sequence(self.run_starts)
+        self.run_last_write = as_sequence(run_last_write)
+        self.run_cursor = None
+        return resources
+
+    # Simulator phases timed when profiling, by method name
+    PROFILED_PHASES = dict(reset='reset', step='step', run_until_miss='_run_until_miss',
+        features='_get_features', reward='_get_reward', observation='_get_observation')
+
+    # Wrap the profiled methods of this instance with timers.
+    def _enable_profiling(self):
+        self.profile_stats = {}
+        self.profile_accesses = 0
+        for phase, name in self.PROFILED_PHASES.items():
+            self.profile_stats[phase] = [0, 0.0]
+            setattr(self, name, self._timed(phase, getattr(self, name)))
+
+    def _timed(self, phase, method):
+        stats = self.profile_stats[phase]
+        def timed(*args, **kwargs):
+            accesses = 0 if phase == 'reset' else self.total_count
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+            if phase in ('reset', 'step'):
+                self.profile_accesses += self.total_count - accesses
+            return result
+        return timed
+
+    # Calls and cumulative wall time of every simulator phase since creation
+    # (or the last clear). Nested phases also count towards their callers:
+    # step includes run_until_miss, observation and reward, and observation
+    # includes features when they are computed eagerly.
+    def profile(self, clear=False):
+        if not self.profiling:
+            raise ValueError("Profiling is off, create the Cache with profiling=True.")
+        result = {phase: dict(calls=calls, seconds=seconds)
+            for phase, (calls, seconds) in self.profile_stats.items()}
+        seconds = result['reset']['seconds'] + result['step']['seconds']
+        result['accesses'] = self.profile_accesses
+        result['accesses_per_second'] = self.profile_accesses / seconds if seconds > 0 else 0.0
+        if clear:
+            for stats in self.profile_stats.values():
+                stats[0], stats[1] = 0, 0.0
+            self.profile_accesses = 0
+        return result
+
     # Display the current cache state
     def display(self):
         print(self.slots)
@@ -80,23 +243,47 @@ class Cache(object):
     def miss_rate(self):
         return self.miss_count / self.total_count
 
-    def reset(self):
+    # Miss rate of every program of the trace over its requests run so far
+    # in this episode, nan for a program not reached yet.
+    def program_miss_rates(self):
+        starts = np.array(self.program_offsets)
+        ends = np.append(starts[1:], len(self.requests))
+        run = np.clip(min(self.cur_index + 1, len(self.requests)) - starts, 0, ends - starts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.array(self.program_misses) / run
+
+    # required_fields: observation fields the agent reads after the cache has
+    # moved on (e.g. in store_transition), computed at every decision epoch.
+    # Other fields are only computed if accessed before the next step.
+    # Leave None to compute every field.
+    def reset(self, required_fields=None):
+        self.required_fields = required_fields
+
         self.total_count = 0
         self.miss_count = 0
+        self.program_misses = [0] * len(self.program_offsets)
 
-        self.cur_index = 0
+        self.cur_index = self._episode_start()
+        self.run_cursor = None
+        self.epoch += 1
+        self.episode += 1
 
-        self.slots = [-1] * self.cache_size
-        self.used_times = [-1] * self.cache_size
-        self.access_bits = [False] * self.cache_size
-        self.dirty_bits = [False] * self.cache_size
+        self.slots.fill(-1)
+        self.used_times.fill(-1)
+        self.access_bits.fill(False)
+        self.dirty_bits.fill(False)
+        self.resource_slots = {}
+
+        self.window_counts = {t: {} for t in self.FEAT_TREMS}
+        self.window_end = 0
 
         slot_id = 0
-        while slot_id < self.cache_size and self.cur_index < len(self.requests):
+        while slot_id < self.cache_size and self._has_request(self.cur_index):
             request = self._current_request()
-            if request not in self.slots:
-                self.miss_count += 1
+            if request not in self.resource_slots:
+                self._count_miss()
                 self.slots[slot_id] = request
+                self.resource_slots[request] = slot_id
                 self.cached_times[slot_id] = self.cur_index
                 self._hit_cache(slot_id)
                 slot_id += 1
@@ -111,6 +298,62 @@ class Cache(object):
 
         return self._get_observation()
 
+    # Index of the first request of an episode
+    def _episode_start(self):
+        return 0
+
+    def _has_request(self, index):
+        return index < len(self.requests)
+
+    # Copy of the mutable cache state of the current episode, to return to
+    # with restore(). The trace and its indexes are shared, not copied.
+    def snapshot(self):
+        return dict(episode=self.episode,
+            cur_index=self.cur_index,
+            total_count=self.total_count,
+            miss_count=self.miss_count,
+            program_misses=list(self.program_misses),
+            evict_count=self.evict_count,
+            slots=self.slots.copy(),
+            used_times=self.used_times.copy(),
+            cached_times=self.cached_times.copy(),
+            access_bits=self.access_bits.copy(),
+            dirty_bits=self.dirty_bits.copy(),
+            resource_slots=self.resource_slots.copy()
+        )
+
+    # Return to a snapshot of the same episode and its observation.
+    def restore(self, snapshot):
+        if snapshot['episode'] != self.episode:
+            raise ValueError("The snapshot belongs to another episode, use reset() instead.")
+        self.epoch += 1
+
+        # Total frequencies are only rewound by the requests run in between,
+        # rather than copied. Feature windows resync on their own.
+        n_requests = len(self.requests)
+        if snapshot['cur_index'] < self.cur_index:
+            for request in self.requests[snapshot['cur_index'] + 1 : min(self.cur_index + 1, n_requests)]:
+                self.resource_freq[request] -= 1
+        else:
+            for request in self.requests[self.cur_index + 1 : min(snapshot['cur_index'] + 1, n_requests)]:
+                self.resource_freq[request] += 1
+
+        self.cur_index = snapshot['cur_index']
+        self.run_cursor = None
+        self.total_count = snapshot['total_count']
+        self.miss_count = snapshot['miss_count']
+        self.program_misses = list(snapshot['program_misses'])
+        self.evict_count = snapshot['evict_count']
+        # In place, so the observation views stay valid
+        np.copyto(self.slots, snapshot['slots'])
+        np.copyto(self.used_times, snapshot['used_times'])
+        np.copyto(self.cached_times, snapshot['cached_times'])
+        np.copyto(self.access_bits, snapshot['access_bits'])
+        np.copyto(self.dirty_bits, snapshot['dirty_bits'])
+        self.resource_slots = snapshot['resource_slots'].copy()
+
+        return self._get_observation()
+
     # Has program finished?
     def hasDone(self):
         return self.cur_index == len(self.requests)
@@ -121,6 +364,8 @@ class Cache(object):
         if self.hasDone():
             raise ValueError("Simulation has finished, use reset() to restart simulation.")
 
+        self.epoch += 1
+
         if not self.allow_skip:
             action += 1
 
@@ -129,14 +374,17 @@ class Cache(object):
 
         # Evict slot of (aciton - 1). action == 0 means skipping eviction.
         if action != 0:
-            out_resource = self.slots[action - 1]
+            out_resource = int(self.slots[action - 1])
             in_resource = self._current_request()
             slot_id = action - 1
+            self.resource_slots.pop(out_resource, None)
             self.slots[slot_id] = in_resource
+            self.resource_slots[in_resource] = slot_id
             self.cached_times[slot_id] = self.cur_index
             self._hit_cache(slot_id)
             self.evict_count += 1
         else:
+            slot_id = None
             skip_resource = self._current_request()
 
         last_index = self.cur_index
@@ -147,6 +395,16 @@ class Cache(object):
         # Get observation.
         observation = self._get_observation()
 
+        reward = self._get_reward(action, last_index, slot_id,
+            out_resource if action != 0 else skip_resource)
+
+        return observation, reward
+
+    # Reward of the action taken at last_index, now that the cache has run to
+    # the next decision epoch. slot_id is the slot that took the missed
+    # resource and out_resource the resource evicted from it, or for a skipped
+    # eviction (action == 0) the resource that was not cached.
+    def _get_reward(self, action, last_index, slot_id, out_resource):
         # Zhong et. al. 2018
         if self.reward_params['name'].lower() == "zhong":
             # Compute reward: R = short term + long term
@@ -159,10 +417,7 @@ class Cache(object):
             start = last_index
             end = last_index + self.reward_params['long_span']
             if end > len(self.requests): end = len(self.requests)
-            long_term_hit = 0
-            next_reqs = self.requests[start : end]
-            for rc in self.slots:
-                long_term_hit += next_reqs.count(rc)
+            long_term_hit = int(self._count_uses(self.slots.tolist(), start, end).sum())
             reward += self.reward_params['beta'] * long_term_hit / (end - start)
 
         # Ours
@@ -177,8 +432,7 @@ class Cache(object):
             # If evction happens at last decision epoch
             if action != 0:
                 # Compute the swap-in reward
-                past_requests = self.requests[last_index + 1 : self.cur_index]
-                reward += self.reward_params['alpha'] * past_requests.count(in_resource)
+                reward += self.reward_params['alpha'] * self._uses_since_cached(slot_id)
                 # Compute the swap-out penalty
                 if miss_resource == out_resource:
                     reward -= self.reward_params['psi'] / (hit_count + self.reward_params['mu'])
@@ -187,30 +441,43 @@ class Cache(object):
                 # Compute the reward of skipping eviction
                 reward += self.reward_params['beta'] * reward
                 # Compute the penalty of skipping eviction
-                if miss_resource == skip_resource:
+                if miss_resource == out_resource:
                     reward -= self.reward_params['psi'] / (hit_count + self.reward_params['mu'])
 
-        return observation, reward
+        return reward
 
-    # Run until next cache miss
+    # Run until next cache miss. A hit on a cached resource extends to the
+    # rest of the run of repeated requests on it, which is accounted for at once.
     def _run_until_miss(self):
         self.cur_index += 1
+        # The request after a miss is in the same run or starts the next one
+        run = self.run_cursor
+        if run is None:
+            run = bisect_right(self.run_starts, self.cur_index) - 1
+        elif self.run_starts[run + 1] <= self.cur_index:
+            run += 1
         while self.cur_index < len(self.requests):
             request = self._current_request()
-            if request not in self.resource_freq:
-                self.resource_freq[request] = 0
-            self.resource_freq[request] += 1
-            self.total_count += 1
-            
-            if request not in self.slots:
-                self.miss_count += 1
+            slot_id = self.resource_slots.get(request)
+            if slot_id is None:
+                self.resource_freq[request] += 1
+                self.total_count += 1
+                self._count_miss()
+                self.run_cursor = run
                 break
-            else:
-                slot_id = self.slots.index(request)
-                self._hit_cache(slot_id)
-            self.cur_index += 1
+            end = self.run_starts[run + 1]
+            self.resource_freq[request] += end - self.cur_index
+            self.total_count += end - self.cur_index
+            self._hit_run(slot_id, run)
+            self.cur_index = end
+            run += 1
         return self.hasDone()
 
+    # Count a miss on the current request, also for its program
+    def _count_miss(self):
+        self.miss_count += 1
+        self.program_misses[bisect_right(self.program_offsets, self.cur_index) - 1] += 1
+
     # In case that the simulation has ended, but we still need the current
     # request for the last observation and reward. Return -1 to eliminate
     # any defects.
@@ -228,13 +495,50 @@ class Cache(object):
         # Record last used time
         self.used_times[slot_id] = self.cur_index
 
+    # Same as _hit_cache() for every request from the current one to the end
+    # of its run, all on the resource in `slot_id`.
+    def _hit_run(self, slot_id, run):
+        self.access_bits[slot_id] = True
+        if self.run_last_write[run] >= self.cur_index:
+            self.dirty_bits[slot_id] = True
+        self.used_times[slot_id] = self.run_starts[run + 1] - 1
+
+    # Slide the per-term window counters up to the current request. Each
+    # counter holds the request counts of requests[cur_index - term + 1 : cur_index + 1],
+    # so every access is added and dropped once per term.
+    def _sync_windows(self):
+        end = self.cur_index + 1
+        if end == self.window_end:
+            return
+        n_requests = len(self.requests)
+        for term, counts in self.window_counts.items():
+            # Too far behind (or moved backwards), recount the whole window.
+            if end < self.window_end or end - self.window_end >= term:
+                counts.clear()
+                for rc in self.requests[max(end - term, 0) : min(end, n_requests)]:
+                    counts[rc] = counts.get(rc, 0) + 1
+                continue
+            for i in range(self.window_end, end):
+                if i < n_requests:
+                    rc = self.requests[i]
+                    counts[rc] = counts.get(rc, 0) + 1
+                if i - term >= 0:
+                    rc = self.requests[i - term]
+                    if counts[rc] == 1:
+                        del counts[rc]
+                    else:
+                        counts[rc] -= 1
+        self.window_end = end
+
     # The number of requests on rc_id among last `term` requests.
+    # Call _sync_windows() first.
     def _elapsed_requests(self, term, rc_id):
-        start = self.cur_index - term + 1
-        if start < 0: start = 0
-        end = self.cur_index + 1
-        if end > len(self.requests): end = len(self.requests)
-        return self.requests[start : end].count(rc_id)
+        return self.window_counts[term].get(rc_id, 0)
+
+    # The number of requests on the resource in slot_id after it was cached,
+    # up to the current request.
+    def _uses_since_cached(self, slot_id):
+        return self.use_rank[int(self.used_times[slot_id])] - self.use_rank[int(self.cached_times[slot_id])]
 
     # The number of requests on rc_id among next `term` requests.
     def _next_requests(self, term, rc_id):
@@ -242,41 +546,100 @@ class Cache(object):
         if start < 0: start = 0
         end = self.cur_index + term
         if end > len(self.requests): end = len(self.requests)
-        return self.requests[start : end].count(rc_id)
+        return int(self._count_uses([rc_id], start, end)[0])
+
+    # The number of requests in [start, end) on each resource in rc_ids,
+    # with two binary searches per resource whatever the span.
+    def _count_uses(self, rc_ids, start, end):
+        n_requests = len(self.requests)
+        start = min(max(start, 0), n_requests)
+        end = min(max(end, start), n_requests)
+        rc_ids = np.asarray(rc_ids, dtype=np.int64)
+        ids = np.searchsorted(self.use_resources, rc_ids)
+        counts = np.searchsorted(self.use_keys, ids * n_requests + end) \
+            - np.searchsorted(self.use_keys, ids * n_requests + start)
+        # Resources never requested, e.g. empty slots
+        known = ids < len(self.use_resources)
+        known[known] = self.use_resources[ids[known]] == rc_ids[known]
+        counts[~known] = 0
+        return counts
+
+    # The index of the next request on the resource cached in slot_id.
+    def _slot_next_use(self, slot_id):
+        index = int(self.used_times[slot_id])
+        n_requests = len(self.requests)
+        if index < 0:
+            return n_requests
+        while index <= self.cur_index and index < n_requests:
+            index = self.next_use[index]
+        return index
 
     # Return the observation features for reinforcement agent
     def _get_features(self):
         # [Freq, F1, F2, ..., Fc] where Fi = [Rs, Rm, Rl]
         # i.e. the request times in short/middle/long term for each
         # cached resource and the currently requested resource.
+        self._sync_windows()
 
         # base
         features = np.concatenate([
             np.array([self._elapsed_requests(t, self._current_request()) for t in self.FEAT_TREMS])
-            , np.array([self._elapsed_requests(t, rc) for rc in self.slots for t in self.FEAT_TREMS])
+            , np.array([self._elapsed_requests(t, rc) for rc in self.slots.tolist() for t in self.FEAT_TREMS])
         ], axis=0)
         
         # last accessed time
         if 'UT' in self.sel_features:
             features = np.concatenate([
                 features
-                , np.array([self.used_times[i] for i in range(self.cache_size)])
+                , self.used_times
             ], axis=0)
         # cached time
         if 'CT' in self.sel_features:
             features = np.concatenate([
                 features
-                , np.array([self.cached_times[i] for i in range(self.cache_size)])
+                , self.cached_times
             ], axis=0)
         
         return features
 
+    def _get_next_use_times(self):
+        return np.array([self._slot_next_use(i) for i in range(self.cache_size)])
+
+    def _get_use_frequency(self):
+        return np.array([self.resource_freq[r] if r >= 0 else 0 for r in self.slots.tolist()])
+
     def _get_observation(self):
-        return dict(features=self._get_features(),
-            cache_state=self.slots.copy(),
-            cached_times=self.cached_times.copy(),
-            last_used_times=self.used_times.copy(),
-            total_use_frequency=[self.resource_freq.get(r, 0) for r in self.slots],
-            access_bits=self.access_bits.copy(),
-            dirty_bits=self.dirty_bits.copy()
-        )
+        return Observation(self, {name: compute() for name, compute in self.computed_fields.items()
+            if self.required_fields is None or name in self.required_fields})
+
+
+# Observation of a decision epoch. The cache state fields are read-only views
+# of the live Cache arrays, so no copies are made per step, and fields that
+# were not required are computed on first access. Both are only valid until
+# the next step() or reset(). Call snapshot() to keep them longer.
+class Observation(Mapping):
+    def __init__(self, cache, computed):
+        self._cache = cache
+        self._epoch = cache.epoch
+        self._computed = computed
+
+    def __getitem__(self, key):
+        if key in self._computed:
+            return self._computed[key]
+        if self._cache.epoch != self._epoch:
+            raise ValueError("Stale observation: the cache has moved on, take a snapshot() first.")
+        if key in self._cache.computed_fields:
+            self._computed[key] = self._cache.computed_fields[key]()
+            return self._computed[key]
+        return self._cache.state_views[key]
+
+    def __iter__(self):
+        yield from self._cache.computed_fields
+        yield from self._cache.state_views
+
+    def __len__(self):
+        return len(self._cache.computed_fields) + len(self._cache.state_views)
+
+    # A plain dict copy of the observation, independent of the cache.
+    def snapshot(self):
+        return {key: np.array(self[key]) for key in self}
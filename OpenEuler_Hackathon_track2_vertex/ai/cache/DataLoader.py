@@ -1,27 +1,328 @@
-import sys, os, random
+import sys, os, glob, random, json, time
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
+# Requests or operations as a sequence of Python ints. NumPy traces are
+# wrapped in a memoryview, which indexes and iterates without copying the
+# trace or boxing NumPy scalars.
+def as_sequence(trace):
+    if isinstance(trace, np.ndarray):
+        return memoryview(np.ascontiguousarray(trace))
+    return trace
+
+# Operations of every loader follow the trace CSVs: 1 for a read and 0 for
+# a write. Note that Cache._hit_cache() sets the dirty bit on operation 1,
+# so its dirty bits mark the slots that were read.
 class DataLoader(object):
     def __init__(self):
         self.requests = []
         self.operations = []
+        # Dense ids: resources[id] is the original resource of request id,
+        # or None if the requests are not dense ids.
+        self.resources = None
 
     def get_requests(self):
         pass
     def get_operations(self):
         pass
 
+    def get_resources(self):
+        return self.resources
+
+# Columns of a Pintos trace CSV, as stored in binary traces
+TRACE_DTYPE = np.dtype([('blocksector', np.int64), ('read/write', np.uint8), ('boot/exec', np.uint8)])
+
+# Prefix of the binary sidecars of a trace file, keyed by its path, size and
+# modification time so that an edited trace is parsed again.
+def trace_sidecar(path):
+    stat = os.stat(path)
+    return "%s.%d-%d" % (path, stat.st_size, stat.st_mtime_ns)
+
+# Arrays of a dense trace, in the order read_dense_trace() returns them
+SIDECAR_ARRAYS = ('requests', 'operations', 'resources')
+
+# Rows of a Pintos trace CSV as a TRACE_DTYPE array, read in chunks of
+# `chunk_size` rows: only the trace columns are parsed, with explicit dtypes,
+# and rows are filtered before they are kept, so memory peaks at the final
+# trace plus one chunk. The `boot` filter is as in DataLoaderPintos.
+def read_trace_csv(path, boot=True, chunk_size=1 << 20):
+    trace = np.empty(chunk_size, dtype=TRACE_DTYPE)
+    n = 0
+    chunks = pd.read_csv(path, header=0, usecols=list(TRACE_DTYPE.names)
+        , dtype={name: TRACE_DTYPE[name] for name in TRACE_DTYPE.names}
+        , chunksize=chunk_size)
+    for chunk in chunks:
+        if not boot: chunk = chunk.loc[chunk['boot/exec'].to_numpy() == 1]
+        m = len(chunk)
+        if n + m > len(trace):
+            grown = np.empty(max(2 * len(trace), n + m), dtype=TRACE_DTYPE)
+            grown[:n] = trace[:n]
+            trace = grown
+        for name in TRACE_DTYPE.names:
+            trace[name][n:n + m] = chunk[name].to_numpy()
+        n += m
+    trace.resize(n, refcheck=False)
+    return trace
+
+# Rows of a Pintos trace CSV, or of a binary trace such as those of
+# convert_monitoring_data_streaming(), as a TRACE_DTYPE array. The `boot`
+# filter is as in DataLoaderPintos.
+def read_trace(path, boot=True):
+    if path.endswith('.npy'):
+        trace = np.load(path, mmap_mode='r')
+        return trace if boot else trace[trace['boot/exec'] == 1]
+    return read_trace_csv(path, boot)
+
+# Requests of a trace file remapped to dense ids, as (requests, operations,
+# resources): int32 ids into the sorted block sectors `resources`, and uint8
+# operations. With binary_cache, the arrays are saved as .npy sidecars on
+# first load, and later loads memory-map them read-only, so nothing is parsed
+# or remapped again and processes share one page-cached copy.
+def read_dense_trace(path, binary_cache=True, boot=True):
+    if binary_cache:
+        prefix = "%s.%s" % (trace_sidecar(path), 'all' if boot else 'exec')
+        sidecars = ["%s.%s.trace.npy" % (prefix, name) for name in SIDECAR_ARRAYS]
+        if all(os.path.exists(sidecar) for sidecar in sidecars):
+            return tuple(np.load(sidecar, mmap_mode='r') for sidecar in sidecars)
+
+    trace = read_trace(path, boot)
+    resources, requests = np.unique(trace['blocksector'], return_inverse=True)
+    dense = (requests.astype(np.int32), np.ascontiguousarray(trace['read/write']), resources)
+    if binary_cache:
+        write_sidecars(path, sidecars, dense)
+    return dense
+
+# Save the arrays of a dense trace to their sidecars, and remove the
+# sidecars of older versions of the trace file.
+def write_sidecars(path, sidecars, arrays):
+    current = trace_sidecar(path) + '.'
+    for sidecar in glob.glob(glob.escape(path) + '.*.trace.npy'):
+        if not sidecar.startswith(current):
+            try:
+                os.remove(sidecar)
+            except OSError:
+                pass
+    for sidecar, array in zip(sidecars, arrays):
+        # Write then rename, so concurrent loaders never see a partial file
+        tmp = "%s.%d.tmp" % (sidecar, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, sidecar)
+        except OSError:
+            # Read-only data directory: keep parsing the trace
+            if os.path.exists(tmp): os.remove(tmp)
+            return
+
+# Requests of one or more Pintos trace CSVs, concatenated in order. The CSVs
+# are loaded concurrently by up to `n_workers` threads. offsets[i] is the
+# index of the first request of progs[i], and offsets[-1] the trace length.
+# Cache.program_miss_rates() and simulate(per_program=True) split the misses
+# by program with them.
 class DataLoaderPintos(DataLoader):
-    def __init__(self, progs, boot=False):
+    def __init__(self, progs, boot=False, binary_cache=True, n_workers=None):
         super(DataLoaderPintos, self).__init__()
 
         if isinstance(progs, str): progs = [progs]
-        for prog in progs:
-            df = pd.read_csv(prog, header=0)
-            if not boot: df = df.loc[df['boot/exec'] == 1, :]
-            self.requests += list(df['blocksector'])
-            self.operations += list(df['read/write'])
+        self.progs = list(progs)
+        if len(self.progs) > 1:
+            with ThreadPoolExecutor(n_workers) as executor:
+                traces = list(executor.map(lambda prog: read_dense_trace(prog, binary_cache, boot), self.progs))
+        else:
+            traces = [read_dense_trace(prog, binary_cache, boot) for prog in self.progs]
+
+        self.offsets = np.zeros(len(traces) + 1, dtype=np.int64)
+        np.cumsum([len(requests) for requests, _, _ in traces], out=self.offsets[1:])
+        if len(traces) == 1:
+            # Dense already, memory-mapped from the sidecars when cached
+            self.requests, self.operations, self.resources = traces[0]
+            return
+
+        # Remap the ids of every program to ids of all their block sectors
+        self.resources = np.unique(np.concatenate([resources for _, _, resources in traces]))
+        self.requests = np.empty(self.offsets[-1], dtype=np.int32)
+        self.operations = np.empty(self.offsets[-1], dtype=np.uint8)
+        for (requests, operations, resources), start, end in zip(traces, self.offsets[:-1], self.offsets[1:]):
+            ids = np.searchsorted(self.resources, resources).astype(np.int32)
+            self.requests[start:end] = ids[requests]
+            self.operations[start:end] = operations
+
+    def get_requests(self):
+        return self.requests
+
+    def get_operations(self):
+        return self.operations
+
+# Requests converted on the fly from the disk_read and disk_write rates of a
+# backend metrics.jsonl, without intermediate CSVs. Every metrics row gives a
+# read then a write request (operations 1 and 0), as in dataPreprocessing,
+# with any of its conversions, see SectorConverter. All requests are kept:
+# the boot/exec flag of those conversions only marks the first row.
+class DataLoaderMetrics(DataLoader):
+    def __init__(self, path, method='smart', block_size=None, chunk_size=100000):
+        super(DataLoaderMetrics, self).__init__()
+        from dataPreprocessing import SectorConverter
+
+        converter = SectorConverter(method, block_size)
+        blocksectors = []
+        # The smart conversion samples the first 100 rows
+        for chunk in pd.read_json(path, lines=True, chunksize=max(chunk_size, 100)):
+            read, write, _ = converter.convert(chunk['disk_read'].to_numpy(), chunk['disk_write'].to_numpy())
+            blocksectors.append(np.column_stack((read, write)).reshape(-1))
+
+        # Remap block sectors to dense ids, stored as int32
+        blocksectors = np.concatenate(blocksectors) if blocksectors else np.zeros(0, dtype=np.int64)
+        self.resources, requests = np.unique(blocksectors, return_inverse=True)
+        self.requests = requests.astype(np.int32)
+        self.operations = np.tile(np.array([1, 0], dtype=np.uint8), len(blocksectors) // 2)
+
+    def get_requests(self):
+        return self.requests
+
+    def get_operations(self):
+        return self.operations
+
+# Follow a metrics.jsonl as it is recorded, like `tail -f`, and yield the
+# (block sector, operation) requests of DataLoaderMetrics, e.g. for a
+# StreamingCache. Stops once no row arrived for `timeout` seconds, or never
+# if timeout is None. The file is read `read_size` bytes at a time, and the
+# rows of every piece are converted and yielded before the next is read, so
+# memory stays bounded however much was recorded before.
+def follow_metrics(path, method='smart', block_size=None, poll_interval=0.5, timeout=None,
+        read_size=1 << 20):
+    from dataPreprocessing import SectorConverter
+
+    converter = SectorConverter(method, block_size)
+    # The smart conversion decides on its first 100 rows
+    min_rows = 100 if method == 'smart' else 1
+    rows = []
+    partial = ''
+    idle = 0.0
+    with open(path) as f:
+        while True:
+            data = f.read(read_size)
+            if data:
+                idle = 0.0
+                # Keep an incomplete last line for the next read
+                lines = (partial + data).split('\n')
+                partial = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        record = json.loads(line)
+                        rows.append((record['disk_read'], record['disk_write']))
+            if len(rows) >= min_rows:
+                for request in _metrics_requests(converter, rows):
+                    yield request
+                rows = []
+                min_rows = 1
+            elif not data:
+                if timeout is not None and idle >= timeout:
+                    break
+                time.sleep(poll_interval)
+                idle += poll_interval
+
+    for request in _metrics_requests(converter, rows):
+        yield request
+
+def _metrics_requests(converter, rows):
+    if not rows:
+        return
+    disk_read, disk_write = zip(*rows)
+    read, write, _ = converter.convert(disk_read, disk_write)
+    for read_sector, write_sector in zip(read.tolist(), write.tolist()):
+        yield read_sector, 1
+        yield write_sector, 0
+
+# Synthetic trace with controlled properties, generated with vectorized NumPy
+# so that traces of 10^8 requests take seconds. Requests are dense ids in
+# [0, n_resources).
+#
+# The trace is split into `n_phases` equal phases. Every phase draws a new
+# working set of `working_set` resources and a new loop. Within a phase the
+# trace is made of segments of `segment_length` requests, each following one
+# access pattern drawn with the weights in `mix`:
+#
+#   zipf - Zipf(zipf_alpha) popularity over the working set of the phase
+#   scan - sequential scan over all resources, continued across segments
+#   loop - cyclic scan over `loop_size` consecutive resources; a loop larger
+#          than the cache defeats LRU
+#
+# Operations are writes (0) with probability `write_ratio` and reads (1)
+# otherwise, as in the other loaders. The same seed always gives the same
+# trace.
+class DataLoaderSynthetic(DataLoader):
+    PATTERNS = ('zipf', 'scan', 'loop')
+    # Requests generated at a time, to bound temporary memory
+    CHUNK_SIZE = 1 << 22
+
+    def __init__(self, n_requests, n_resources=100000
+        , mix=dict(zipf=1.0)
+        , zipf_alpha=1.0
+        , working_set=None
+        , loop_size=1000
+        , segment_length=1000
+        , n_phases=1
+        , write_ratio=0.3
+        , seed=None
+    ):
+        super(DataLoaderSynthetic, self).__init__()
+
+        for name in mix:
+            if name not in self.PATTERNS:
+                raise ValueError("Unknown access pattern %s." % name)
+        names = list(mix)
+        weights = np.array([mix[name] for name in names], dtype=np.float64)
+        if len(names) == 0 or (weights < 0).any() or weights.sum() <= 0:
+            raise ValueError("The pattern mix needs positive weights.")
+        weights /= weights.sum()
+
+        if working_set is None: working_set = n_resources
+        if not 0 < working_set <= n_resources or not 0 < loop_size <= n_resources:
+            raise ValueError("The working set and loop must fit in %d resources." % n_resources)
+        if n_resources > np.iinfo(np.int32).max:
+            raise ValueError("Resource ids must fit in int32.")
+
+        rng = np.random.default_rng(seed)
+        # Zipf CDF over popularity ranks
+        cdf = np.cumsum(np.arange(1, working_set + 1, dtype=np.float64) ** -zipf_alpha)
+        cdf /= cdf[-1]
+
+        self.requests = np.empty(n_requests, dtype=np.int32)
+        self.operations = np.empty(n_requests, dtype=np.uint8)
+        self.resources = np.arange(n_resources)
+
+        chunk_size = max(1, self.CHUNK_SIZE // segment_length) * segment_length
+        phase_bounds = np.linspace(0, n_requests, n_phases + 1).astype(np.int64)
+        scan_next = 0
+        for phase in range(n_phases):
+            # Working set of the phase, hottest first, and its loop
+            hot = rng.choice(n_resources, working_set, replace=False).astype(np.int32)
+            loop_start = int(rng.integers(n_resources))
+            loop_next = 0
+
+            for start in range(phase_bounds[phase], phase_bounds[phase + 1], chunk_size):
+                end = min(start + chunk_size, phase_bounds[phase + 1])
+                n = end - start
+                n_segments = -(-n // segment_length)
+                patterns = np.repeat(rng.choice(len(names), n_segments, p=weights)
+                    .astype(np.uint8), segment_length)[:n]
+                requests = self.requests[start:end]
+                for k, name in enumerate(names):
+                    mask = patterns == k
+                    count = int(np.count_nonzero(mask))
+                    if count == 0:
+                        continue
+                    if name == 'zipf':
+                        requests[mask] = hot[np.searchsorted(cdf, rng.random(count), side='right')]
+                    elif name == 'scan':
+                        requests[mask] = (scan_next + np.arange(count, dtype=np.int64)) % n_resources
+                        scan_next = (scan_next + count) % n_resources
+                    else:
+                        offsets = (loop_next + np.arange(count, dtype=np.int64)) % loop_size
+                        requests[mask] = (loop_start + offsets) % n_resources
+                        loop_next = (loop_next + count) % loop_size
+                self.operations[start:end] = rng.random(n) >= write_ratio
 
     def get_requests(self):
         return self.requests
@@ -29,9 +330,71 @@ class DataLoaderPintos(DataLoader):
     def get_operations(self):
         return self.operations
 
+# Hash of integer resources to [0, 1), with a seed selecting the hash
+# function (splitmix64 finalizer).
+def resource_hash(resources, seed=0):
+    with np.errstate(over='ignore'):
+        x = np.asarray(resources).astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+# Cache size scaled by a sampling rate, see DataLoaderSampled. Rounding a
+# fractional size would bias the estimate by more than its error, so the
+# scaled size must be a whole number of slots.
+def scale_cache_size(cache_size, rate):
+    scaled = cache_size * rate
+    if scaled < 1 or abs(scaled - round(scaled)) > 1e-6 * scaled:
+        raise ValueError("Cache size %d at sampling rate %g is %g slots, not a whole number. "
+            "Use a rate that is a multiple of 1/%d." % (cache_size, rate, scaled, cache_size))
+    return int(round(scaled))
+
+# Spatially sampled trace (SHARDS, Waldspurger et al. 2015): every request
+# on a resource whose hash is below `rate` is kept, so a fraction `rate` of
+# the resources is sampled with all of its requests. Simulating the sample
+# with a cache scaled by the same rate, see scale_cache_size(), estimates
+# the miss rate of the full trace at a fraction of the cost. Different
+# seeds give independent samples.
+class DataLoaderSampled(DataLoader):
+    def __init__(self, trace, rate, seed=0, operations=None):
+        super(DataLoaderSampled, self).__init__()
+        if not 0 < rate <= 1:
+            raise ValueError("The sampling rate must be in (0, 1].")
+        self.rate = rate
+        self.seed = seed
+
+        if isinstance(trace, DataLoader):
+            requests = np.asarray(trace.get_requests())
+            operations = np.asarray(trace.get_operations())
+            resources = trace.get_resources()
+        else:
+            requests = np.asarray(trace)
+            resources = None
+            if operations is None:
+                operations = np.random.randint(0, 2, len(requests))
+            operations = np.asarray(operations)
+
+        # Hash the original resources, so the sample does not depend on ids
+        if resources is not None:
+            keep = (resource_hash(resources, seed) < rate)[requests]
+            resources = np.asarray(resources)
+        else:
+            keep = resource_hash(requests, seed) < rate
+            resources = None
+
+        # Remap the sampled requests to dense ids, stored as int32
+        sampled, requests = np.unique(requests[keep], return_inverse=True)
+        self.resources = sampled if resources is None else resources[sampled]
+        self.requests = requests.astype(np.int32)
+        self.operations = operations[keep].astype(np.uint8)
+
+    # Cache size to simulate the sample with
+    def scale_cache_size(self, cache_size):
+        return scale_cache_size(cache_size, self.rate)
 
     def get_requests(self):
         return self.requests
 
     def get_operations(self):
-        return self.operations
\ No newline at end of file
+        return self.operations
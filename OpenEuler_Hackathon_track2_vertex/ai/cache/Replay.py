@@ -0,0 +1,215 @@
+import random, heapq
+import numpy as np
+from collections import OrderedDict
+from cache.Cache import next_use_index
+from cache.DataLoader import DataLoader, DataLoaderSampled, as_sequence
+
+# Fast trace replay for the classic, non-learning policies. The whole trace
+# is replayed in one loop without Cache.step() and observations, and the
+# results are exactly those of the matching ReflexAgent on a fresh Cache
+# without skipping (allow_skip=False):
+#
+#   LRU / MRU  - ordered dict in recency order
+#   LFU        - min-heap of (frequency, slot) with lazy deletion
+#   Belady     - max-heap of (next use, slot) with lazy deletion
+#   Random     - draws from `random` exactly as RandomAgent does
+#
+# Returns (miss_count, total_count), or with per_program the misses and
+# requests of every program of a DataLoaderPintos trace, see its offsets.
+def simulate(trace, cache_size, policy, per_program=False):
+    offsets = None
+    if isinstance(trace, DataLoader):
+        requests = as_sequence(trace.get_requests())
+        offsets = getattr(trace, 'offsets', None)
+    else:
+        requests = as_sequence(trace)
+    if offsets is None:
+        offsets = [0, len(requests)]
+
+    if len(requests) <= cache_size:
+        raise ValueError("The count of requests are too small. Try larger one.")
+
+    if policy not in REPLAY_POLICIES:
+        raise ValueError("No replay engine for policy %s." % policy)
+    # Misses up to the end of every program
+    misses = REPLAY_POLICIES[policy](requests, cache_size, [int(offset) for offset in offsets[1:]])
+    if per_program:
+        return np.diff(misses, prepend=0), np.diff(offsets)
+    return misses[-1], len(requests)
+
+# Miss rate of `policy` estimated on `n_samples` spatially sampled traces at
+# `rate`, see DataLoaderSampled, each with seeds seed, seed + 1, ... The
+# policy is a name in REPLAY_POLICIES, or a function (dataloader, cache_size)
+# returning (miss_count, total_count), e.g. running a Cache and an agent.
+# Returns the mean miss rate and its sampling standard error, the spread of
+# the samples only (nan for a single sample).
+#
+# The error does not cover the bias of sampling itself. Sampling keeps the
+# reuse distances of the sampled blocks in proportion, which the miss rates
+# of the SAMPLED_POLICIES depend on. MRU instead pins the blocks left over
+# from the fill, which does not scale, so its estimate can be off by several
+# errors and its error is nan.
+def estimate_miss_rate(trace, cache_size, policy, rate, n_samples=4, seed=0):
+    biased = not callable(policy) and policy not in SAMPLED_POLICIES
+    if not callable(policy):
+        name = policy
+        policy = lambda dataloader, size: simulate(dataloader, size, name)
+    miss_rates = []
+    for i in range(n_samples):
+        dataloader = DataLoaderSampled(trace, rate, seed + i)
+        miss_count, total_count = policy(dataloader, dataloader.scale_cache_size(cache_size))
+        miss_rates.append(miss_count / total_count)
+    error = np.std(miss_rates, ddof=1) / np.sqrt(n_samples) if n_samples > 1 and not biased else float('nan')
+    return float(np.mean(miss_rates)), float(error)
+
+# Fill the empty cache like Cache.reset(): the first `cache_size` distinct
+# requests take the slots in order. Hits during the fill do not count as uses.
+# Returns the slots, the index of the first request after the fill, and the
+# misses up to every program end in `ends` the fill went past.
+#
+# The engines replay the rest of the trace program by program, and return
+# the misses up to every end in `ends`, the last one being the trace length.
+def _fill(requests, cache_size, ends):
+    slots = []
+    cached = set()
+    misses = []
+    index = 0
+    while len(slots) < cache_size and index < len(requests):
+        while ends[len(misses)] <= index:
+            misses.append(len(slots))
+        request = requests[index]
+        if request not in cached:
+            cached.add(request)
+            slots.append(request)
+        index += 1
+    return slots, index, misses
+
+def _replay_recency(requests, cache_size, ends, evict_last):
+    slots, start, misses = _fill(requests, cache_size, ends)
+    miss_count = len(slots)
+    # Least recently used first
+    recency = OrderedDict.fromkeys(slots)
+    move_to_end = recency.move_to_end
+    for end in ends[len(misses):]:
+        for request in requests[start:end]:
+            if request in recency:
+                move_to_end(request)
+            else:
+                miss_count += 1
+                recency.popitem(last=evict_last)
+                recency[request] = None
+        misses.append(miss_count)
+        start = end
+    return misses
+
+def _replay_lru(requests, cache_size, ends):
+    return _replay_recency(requests, cache_size, ends, evict_last=False)
+
+def _replay_mru(requests, cache_size, ends):
+    return _replay_recency(requests, cache_size, ends, evict_last=True)
+
+# The lazy-deletion heaps of LFU and Belady get an entry per hit, but only
+# drop outdated ones on misses. They are rebuilt from the live slots once
+# they hold this many entries per slot, so they stay O(cache_size).
+HEAP_SLACK = 4
+
+def _replay_lfu(requests, cache_size, ends):
+    slots, start, misses = _fill(requests, cache_size, ends)
+    miss_count = len(slots)
+    resource_slots = {rc: slot_id for slot_id, rc in enumerate(slots)}
+    # Accesses since the fill, as in Cache.resource_freq
+    freq = {}
+    # (frequency, slot id, resource); ties go to the lowest slot like argmin
+    heap = [(0, slot_id, rc) for slot_id, rc in enumerate(slots)]
+    for end in ends[len(misses):]:
+        for request in requests[start:end]:
+            f = freq.get(request, 0) + 1
+            freq[request] = f
+            slot_id = resource_slots.get(request)
+            if slot_id is not None:
+                heapq.heappush(heap, (f, slot_id, request))
+                if len(heap) > HEAP_SLACK * cache_size:
+                    heap = [(freq.get(rc, 0), slot_id, rc) for rc, slot_id in resource_slots.items()]
+                    heapq.heapify(heap)
+                continue
+            miss_count += 1
+            # Drop entries outdated by later hits or evictions
+            while True:
+                f_out, slot_id, out = heapq.heappop(heap)
+                if resource_slots.get(out) == slot_id and freq.get(out, 0) == f_out:
+                    break
+            del resource_slots[out]
+            resource_slots[request] = slot_id
+            heapq.heappush(heap, (f, slot_id, request))
+        misses.append(miss_count)
+        start = end
+    return misses
+
+def _replay_belady(requests, cache_size, ends):
+    slots, start, misses = _fill(requests, cache_size, ends)
+    miss_count = len(slots)
+    next_use = as_sequence(next_use_index(requests))
+    # Next request on each cached resource at or after the fill
+    first_use = {}
+    for index in range(start):
+        first_use.setdefault(requests[index], index)
+    slot_next = []
+    for rc in slots:
+        index = first_use[rc]
+        while index < start:
+            index = next_use[index]
+        slot_next.append(index)
+    # (-next use, slot id); ties go to the lowest slot like argmax
+    heap = [(-index, slot_id) for slot_id, index in enumerate(slot_next)]
+    heapq.heapify(heap)
+    resource_slots = {rc: slot_id for slot_id, rc in enumerate(slots)}
+    for end in ends[len(misses):]:
+        for index in range(start, end):
+            request = requests[index]
+            slot_id = resource_slots.get(request)
+            if slot_id is None:
+                miss_count += 1
+                # Drop entries outdated by later hits or evictions
+                while True:
+                    negative_next, slot_id = heapq.heappop(heap)
+                    if slot_next[slot_id] == -negative_next:
+                        break
+                del resource_slots[slots[slot_id]]
+                slots[slot_id] = request
+                resource_slots[request] = slot_id
+            slot_next[slot_id] = next_use[index]
+            heapq.heappush(heap, (-next_use[index], slot_id))
+            if len(heap) > HEAP_SLACK * cache_size:
+                heap = [(-index, slot_id) for slot_id, index in enumerate(slot_next)]
+                heapq.heapify(heap)
+        misses.append(miss_count)
+        start = end
+    return misses
+
+def _replay_random(requests, cache_size, ends):
+    slots, start, misses = _fill(requests, cache_size, ends)
+    miss_count = len(slots)
+    resource_slots = {rc: slot_id for slot_id, rc in enumerate(slots)}
+    for end in ends[len(misses):]:
+        for request in requests[start:end]:
+            if request not in resource_slots:
+                miss_count += 1
+                # Same draw as RandomAgent._choose_action(cache_size)
+                slot_id = random.randint(0, cache_size - 1)
+                del resource_slots[slots[slot_id]]
+                slots[slot_id] = request
+                resource_slots[request] = slot_id
+        misses.append(miss_count)
+        start = end
+    return misses
+
+REPLAY_POLICIES = {
+    'LRU': _replay_lru,
+    'MRU': _replay_mru,
+    'LFU': _replay_lfu,
+    'Belady': _replay_belady,
+    'Random': _replay_random,
+}
+
+# Policies whose sampled estimates come with an error, see estimate_miss_rate()
+SAMPLED_POLICIES = ('LRU', 'LFU', 'Belady', 'Random')
@@ -0,0 +1,77 @@
+import sys
+import numpy as np
+from cache.DataLoader import DataLoader, DataLoaderPintos, as_sequence
+
+# One-pass LRU miss ratio curve (Mattson et al. 1970).
+#
+# The stack distance of a request is the number of distinct resources
+# requested since the previous request on the same resource, itself
+# included. An LRU cache of size c hits exactly the requests with
+# distance <= c, so one pass over the trace gives the miss rate of every
+# cache size at once. Distances are counted with a Fenwick tree over the
+# times of the latest request on every resource, O(n log n) in total.
+#
+# This is plain LRU. Cache.reset() does not count hits while filling the
+# empty cache as uses, so LRUAgent may differ by a few misses on the
+# first `cache_size` distinct requests.
+
+# Stack distance of every request, 0 for the first request on a resource.
+def stack_distances(trace):
+    if isinstance(trace, DataLoader):
+        requests = as_sequence(trace.get_requests())
+    else:
+        requests = as_sequence(trace)
+
+    n = len(requests)
+    # Fenwick tree marking the time of the latest request on every resource
+    tree = [0] * (n + 1)
+    last_time = {}
+    distances = np.zeros(n, dtype=np.int64)
+    for t, rc in enumerate(requests):
+        p = last_time.get(rc)
+        if p is not None:
+            # Latest requests at times <= p
+            i, before = p + 1, 0
+            while i > 0:
+                before += tree[i]
+                i -= i & -i
+            # Every resource requested after p, plus rc itself
+            distances[t] = len(last_time) - before + 1
+            i = p + 1
+            while i <= n:
+                tree[i] -= 1
+                i += i & -i
+        last_time[rc] = t
+        i = t + 1
+        while i <= n:
+            tree[i] += 1
+            i += i & -i
+    return distances
+
+# histogram[d] is the number of requests with stack distance d; histogram[0]
+# counts the cold misses.
+def reuse_distance_histogram(trace):
+    return np.bincount(stack_distances(trace))
+
+# mrc[c] is the LRU miss rate of a cache with c slots, for c = 0..max_size.
+# max_size defaults to the number of distinct resources, beyond which only
+# cold misses remain.
+def miss_ratio_curve(trace, max_size=None):
+    histogram = reuse_distance_histogram(trace)
+    total = histogram.sum()
+    if max_size is None:
+        max_size = histogram[0]
+    hits = np.zeros(max_size + 1, dtype=np.int64)
+    n_sizes = min(max_size + 1, len(histogram))
+    hits[1:n_sizes] = np.cumsum(histogram[1:n_sizes])
+    hits[n_sizes:] = hits[n_sizes - 1]
+    return 1.0 - hits / total
+
+
+# Usage: python -m cache.StackDistance trace.csv [max_size]
+if __name__ == "__main__":
+    dataloader = DataLoaderPintos(sys.argv[1])
+    max_size = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    mrc = miss_ratio_curve(dataloader, max_size)
+    for cache_size, mr in enumerate(mrc):
+        print("CacheSize=%d: MissRate=%f" % (cache_size, mr))
@@ -0,0 +1,121 @@
+from collections import deque
+from itertools import islice
+from cache.Cache import Cache
+
+# The latest `size` items of a stream, indexed by their absolute position.
+# len() is the number of items seen so far.
+class StreamHistory(object):
+    def __init__(self, size):
+        self.items = deque(maxlen=size)
+        self.n_seen = 0
+
+    def append(self, item):
+        self.items.append(item)
+        self.n_seen += 1
+
+    def __len__(self):
+        return self.n_seen
+
+    def __getitem__(self, index):
+        first = self.n_seen - len(self.items)
+        if isinstance(index, slice):
+            start = first if index.start is None else index.start
+            stop = self.n_seen if index.stop is None else min(index.stop, self.n_seen)
+            if start < first:
+                raise IndexError("Request %d is out of the stream history." % start)
+            return list(islice(self.items, start - first, max(stop, start) - first))
+        if index < first or index >= self.n_seen:
+            raise IndexError("Request %d is out of the stream history." % index)
+        return self.items[index - first]
+
+# Cache fed by an iterator of (block, operation) pairs of unknown length,
+# e.g. a multi-GB trace or a live feed. Only the history needed by the
+# feature windows is kept, so memory does not grow with the stream.
+#
+# Anything that looks into the future is unavailable: the 'zhong' reward,
+# next_use_times (so BeladyAgent), _next_requests() and snapshots, since
+# the stream cannot be rewound. Each reset() starts a new episode at the
+# next unread request of the stream.
+class StreamingCache(Cache):
+    def __init__(self, stream, cache_size
+        , terms=[10, 100, 1000]
+        , feature_selection=('Base',)
+        , reward_params=dict(name='our', alpha=0.5, psi=10, mu=1, beta=0.3)
+        , allow_skip=False
+        , profiling=False
+    ):
+        if reward_params['name'].lower() != 'our':
+            raise ValueError("Reward %s looks ahead in the trace, which a stream cannot." % reward_params['name'])
+
+        # Enough history to slide every feature window, see Cache._sync_windows()
+        self.history_size = 2 * max(terms) + 1
+
+        super(StreamingCache, self).__init__(stream, cache_size
+            , terms=terms
+            , feature_selection=feature_selection
+            , reward_params=reward_params
+            , allow_skip=allow_skip
+            , profiling=profiling
+        )
+        del self.computed_fields['next_use_times']
+
+        # Hits on each slot since its resource was cached
+        self.slot_uses = [0] * self.cache_size
+
+    def _load_requests(self, stream, operations, cache_size):
+        self.stream = iter(stream)
+        self.exhausted = False
+        self.requests = StreamHistory(self.history_size)
+        self.operations = StreamHistory(1)
+        return None
+
+    def _episode_start(self):
+        return len(self.requests)
+
+    # Read the stream up to `index` if needed.
+    def _has_request(self, index):
+        while index >= len(self.requests) and not self.exhausted:
+            try:
+                request, operation = next(self.stream)
+            except StopIteration:
+                self.exhausted = True
+                break
+            self.requests.append(int(request))
+            self.operations.append(int(operation))
+        return index < len(self.requests)
+
+    def hasDone(self):
+        return not self._has_request(self.cur_index)
+
+    # Same as Cache._run_until_miss(), reading from the stream
+    def _run_until_miss(self):
+        self.cur_index += 1
+        while self._has_request(self.cur_index):
+            request = self.requests[self.cur_index]
+            self.resource_freq[request] += 1
+            self.total_count += 1
+
+            slot_id = self.resource_slots.get(request)
+            if slot_id is None:
+                self._count_miss()
+                break
+            else:
+                self._hit_cache(slot_id)
+            self.cur_index += 1
+        return self.hasDone()
+
+    def _hit_cache(self, slot_id):
+        super(StreamingCache, self)._hit_cache(slot_id)
+        if self.cached_times[slot_id] == self.cur_index:
+            self.slot_uses[slot_id] = 0
+        else:
+            self.slot_uses[slot_id] += 1
+
+    def _uses_since_cached(self, slot_id):
+        return self.slot_uses[slot_id]
+
+    def snapshot(self):
+        raise ValueError("A stream cannot be rewound to a snapshot.")
+
+    def _next_requests(self, term, rc_id):
+        raise ValueError("A stream has no future requests to count.")
@@ -0,0 +1,78 @@
+import numpy as np
+from cache.Cache import Cache
+from cache.DataLoader import DataLoader
+
+# Whether requests is a single trace of resources rather than a list of traces
+def _is_flat(requests):
+    if isinstance(requests, np.ndarray):
+        return requests.ndim == 1 and requests.dtype != object
+    return len(requests) > 0 and isinstance(requests[0], (int, np.integer))
+
+# N independent cache environments stepped together, in the spirit of a gym
+# VectorEnv. Observations are stacked along the first axis, so
+# observations['features'] is an (n_envs, n_features) matrix that can be fed
+# to an agent in one batch.
+class VectorCache(object):
+    def __init__(self, requests, cache_size, n_envs=None
+        # leave none for random read/writes
+        , operations=None
+        # Any other keyword argument is passed to every Cache
+        , **kwargs
+    ):
+        # One trace shared by all environments, or one trace per environment.
+        # A flat trace of requests is a single shared trace.
+        if isinstance(requests, DataLoader) or n_envs is not None or _is_flat(requests):
+            if n_envs is None: n_envs = 1
+            traces = [requests] * n_envs
+            operations = [operations] * n_envs
+        else:
+            traces = list(requests)
+            if operations is None: operations = [None] * len(traces)
+        if len(traces) == 0:
+            raise ValueError("VectorCache needs at least one environment.")
+
+        self.envs = [Cache(trace, cache_size, operations=ops, **kwargs)
+            for trace, ops in zip(traces, operations)]
+        self.n_envs = len(self.envs)
+        self.cache_size = cache_size
+        self.n_actions = self.envs[0].n_actions
+        self.n_features = self.envs[0].n_features
+
+        # Miss rates of every finished episode, per environment
+        self.episode_miss_rates = [[] for _ in range(self.n_envs)]
+
+    # Return current miss rates
+    def miss_rates(self):
+        return np.array([env.miss_rate() for env in self.envs])
+
+    # See Cache.reset() for required_fields. Stacked observations only hold
+    # the required fields and the cache state.
+    def reset(self, required_fields=None):
+        return self._stack([env.reset(required_fields) for env in self.envs])
+
+    # Take one action in every environment. Environments whose episode ends
+    # are reset immediately, and their returned observation is the first of
+    # the next episode; `dones` marks them.
+    def step(self, actions):
+        actions = np.asarray(actions)
+        if actions.shape != (self.n_envs,):
+            raise ValueError("Expected %d actions, got shape %s." % (self.n_envs, actions.shape))
+
+        observations = []
+        rewards = np.zeros(self.n_envs)
+        dones = np.zeros(self.n_envs, dtype=bool)
+        for i, env in enumerate(self.envs):
+            observation, rewards[i] = env.step(int(actions[i]))
+            if env.hasDone():
+                dones[i] = True
+                self.episode_miss_rates[i].append(env.miss_rate())
+                observation = env.reset(env.required_fields)
+            observations.append(observation)
+
+        return self._stack(observations), rewards, dones
+
+    def _stack(self, observations):
+        env = self.envs[0]
+        keys = [key for key in observations[0] if env.required_fields is None
+            or key in env.required_fields or key in env.state_views]
+        return {key: np.stack([np.asarray(o[key]) for o in observations]) for key in keys}
@@ -1,6 +1,25 @@
+import struct
 import pandas as pd
 import numpy as np
 
+# Convert byte counts to block sectors, rounding non-zero counts up with
+# `ceiling` so that small requests are not lost, otherwise truncating.
+def bytes_to_sectors(values, block_size, ceiling):
+    values = np.asarray(values, dtype=np.float64)
+    if ceiling:
+        return np.where(values > 0, np.ceil(values / block_size), 0).astype(np.int64)
+    return (values / block_size).astype(np.int64)
+
+# Blocksector rows of the metrics rows: a read row followed by a write row
+# for every metrics row. boot_exec flags every metrics row.
+def interleave_operations(read_sectors, write_sectors, boot_exec):
+    n = len(read_sectors)
+    return pd.DataFrame({
+        'blocksector': np.column_stack((read_sectors, write_sectors)).reshape(2 * n),
+        'read/write': np.tile(np.array([1, 0], dtype=np.int64), n),  # 1 for read, 0 for write
+        'boot/exec': np.repeat(np.asarray(boot_exec, dtype=np.int64), 2)
+    })
+
 def convert_monitoring_data(input_csv, output_csv='blocksector_format.csv'):
     """
     Convert OpenEuler monitoring data to blocksector format.
@@ -17,9 +36,6 @@ def convert_monitoring_data(input_csv, output_csv='blocksector_format.csv'):
     print(f"Input file loaded: {len(df)} rows")
     print(f"Columns: {df.columns.tolist()}")
     
-    # Initialize output data structure
-    output_data = []
-    
     # Block size in bytes (Pintos standard)
     BLOCK_SIZE = 512
     
@@ -35,43 +51,22 @@ def convert_monitoring_data(input_csv, output_csv='blocksector_format.csv'):
     if use_ceiling:
         print(f"⚠ Detected small byte values (avg_read={avg_read:.2f}, avg_write={avg_write:.2f})")
         print(f"  Using CEILING division to preserve small requests")
-        conversion_func = lambda x: int(np.ceil(x / BLOCK_SIZE)) if x > 0 else 0
     else:
         print(f"✓ Normal byte values detected (avg_read={avg_read:.2f}, avg_write={avg_write:.2f})")
         print(f"  Using FLOOR division (standard behavior)")
-        conversion_func = lambda x: int(x / BLOCK_SIZE)
     
     print("\nFirst few input values:")
     print(df[['disk_read', 'disk_write']].head(10))
     
-    # Process each row
-    for idx, row in df.iterrows():
-        disk_read = row['disk_read']
-        disk_write = row['disk_write']
-        
-        # Convert bytes to block sectors
-        blocksector_read = conversion_func(disk_read)
-        blocksector_write = conversion_func(disk_write)
-        
-        # Determine boot/exec status
-        boot_exec = 1 if idx == 0 else 0  # 1 for boot, 0 for exec
-        
-        # Add read operation
-        output_data.append({
-            'blocksector': blocksector_read,
-            'read/write': 1,  # 1 for read
-            'boot/exec': boot_exec
-        })
-        
-        # Add write operation
-        output_data.append({
-            'blocksector': blocksector_write,
-            'read/write': 0,  # 0 for write
-            'boot/exec': boot_exec
-        })
+    # Convert bytes to block sectors
+    blocksector_read = bytes_to_sectors(df['disk_read'], BLOCK_SIZE, use_ceiling)
+    blocksector_write = bytes_to_sectors(df['disk_write'], BLOCK_SIZE, use_ceiling)
+    
+    # Determine boot/exec status
+    boot_exec = df.index == 0  # 1 for boot, 0 for exec
     
-    # Create output DataFrame
-    output_df = pd.DataFrame(output_data)
+    # Create output DataFrame, a read then a write operation per row
+    output_df = interleave_operations(blocksector_read, blocksector_write, boot_exec)
     
     # Statistics
     zero_count = (output_df['blocksector'] == 0).sum()
@@ -115,31 +110,11 @@ def convert_with_smaller_blocksize(input_csv, output_csv='blocksector_format.csv
     df = pd.read_csv(input_csv)
     print(f"Using custom BLOCK_SIZE={block_size} bytes")
     
-    output_data = []
-    
-    for idx, row in df.iterrows():
-        disk_read = row['disk_read']
-        disk_write = row['disk_write']
-        
-        # Use ceiling for any non-zero value
-        blocksector_read = int(np.ceil(disk_read / block_size)) if disk_read > 0 else 0
-        blocksector_write = int(np.ceil(disk_write / block_size)) if disk_write > 0 else 0
-        
-        boot_exec = 1 if idx == 0 else 0
-        
-        output_data.append({
-            'blocksector': blocksector_read,
-            'read/write': 1,
-            'boot/exec': boot_exec
-        })
-        
-        output_data.append({
-            'blocksector': blocksector_write,
-            'read/write': 0,
-            'boot/exec': boot_exec
-        })
+    # Use ceiling for any non-zero value
+    blocksector_read = bytes_to_sectors(df['disk_read'], block_size, ceiling=True)
+    blocksector_write = bytes_to_sectors(df['disk_write'], block_size, ceiling=True)
     
-    output_df = pd.DataFrame(output_data)
+    output_df = interleave_operations(blocksector_read, blocksector_write, df.index == 0)
     output_df.to_csv(output_csv, index=False)
     
     nonzero = (output_df['blocksector'] > 0).sum()
@@ -156,7 +131,6 @@ def convert_with_cumulative_sectors(input_csv, output_csv='blocksector_format.cs
     """
     
     df = pd.read_csv(input_csv)
-    output_data = []
     BLOCK_SIZE = 256
     
     # Calculate cumulative sectors
@@ -167,23 +141,9 @@ def convert_with_cumulative_sectors(input_csv, output_csv='blocksector_format.cs
     print(f"  Final read sector: {df['cumulative_read_sectors'].iloc[-1]}")
     print(f"  Final write sector: {df['cumulative_write_sectors'].iloc[-1]}")
     
-    for idx, row in df.iterrows():
-        boot_exec = 1 if idx == 0 else 0
-        
-        # Use cumulative sector numbers
-        output_data.append({
-            'blocksector': int(row['cumulative_read_sectors']),
-            'read/write': 1,
-            'boot/exec': boot_exec
-        })
-        
-        output_data.append({
-            'blocksector': int(row['cumulative_write_sectors']),
-            'read/write': 0,
-            'boot/exec': boot_exec
-        })
-    
-    output_df = pd.DataFrame(output_data)
+    # Use cumulative sector numbers
+    output_df = interleave_operations(df['cumulative_read_sectors'].to_numpy(dtype=np.int64)
+        , df['cumulative_write_sectors'].to_numpy(dtype=np.int64), df.index == 0)
     output_df.to_csv(output_csv, index=False)
     
     unique = output_df['blocksector'].nunique()
@@ -193,6 +153,135 @@ def convert_with_cumulative_sectors(input_csv, output_csv='blocksector_format.cs
     return output_df
 
 
+class SectorConverter(object):
+    """
+    Incremental version of the three conversions above, for metrics that
+    arrive in batches. State carried across batches: the row count for the
+    boot/exec flag of the first row, the ceiling/floor choice of the smart
+    conversion, and the running byte totals of the cumulative conversion.
+    Batches give the same sectors as converting all rows at once, as long as
+    the first batch of the smart conversion holds the 100 rows it samples.
+    
+    Parameters:
+    - method: 'smart' (convert_monitoring_data), 'blocksize'
+      (convert_with_smaller_blocksize) or 'cumulative'
+      (convert_with_cumulative_sectors)
+    - block_size: Block size in bytes, defaults to that of the method
+    """
+    
+    BLOCK_SIZES = dict(smart=512, blocksize=128, cumulative=256)
+    
+    def __init__(self, method='smart', block_size=None):
+        if method not in self.BLOCK_SIZES:
+            raise ValueError("Unknown conversion method %s." % method)
+        self.method = method
+        self.block_size = self.BLOCK_SIZES[method] if block_size is None else block_size
+        self.use_ceiling = None if method == 'smart' else method == 'blocksize'
+        self.n_rows = 0
+        self.read_total = 0.0
+        self.write_total = 0.0
+    
+    def convert(self, disk_read, disk_write):
+        """
+        Convert a batch of metrics rows.
+        
+        Returns the read sectors, write sectors and boot/exec flags of the rows.
+        """
+        disk_read = np.asarray(disk_read, dtype=np.float64)
+        disk_write = np.asarray(disk_write, dtype=np.float64)
+        n = len(disk_read)
+        
+        if self.use_ceiling is None:
+            # Same sampling as convert_monitoring_data
+            sample_reads = disk_read[:100]
+            sample_writes = disk_write[:100]
+            avg_read = sample_reads[sample_reads > 0].mean() if (sample_reads > 0).any() else 0
+            avg_write = sample_writes[sample_writes > 0].mean() if (sample_writes > 0).any() else 0
+            self.use_ceiling = bool((avg_read < self.block_size * 2) or (avg_write < self.block_size * 2))
+        
+        if self.method == 'cumulative':
+            # Continue the running sums exactly where the last batch stopped
+            read_cumsum = np.cumsum(np.concatenate(([self.read_total], disk_read)))
+            write_cumsum = np.cumsum(np.concatenate(([self.write_total], disk_write)))
+            self.read_total = read_cumsum[-1]
+            self.write_total = write_cumsum[-1]
+            blocksector_read = (read_cumsum[1:] / self.block_size).astype(np.int64)
+            blocksector_write = (write_cumsum[1:] / self.block_size).astype(np.int64)
+        else:
+            blocksector_read = bytes_to_sectors(disk_read, self.block_size, self.use_ceiling)
+            blocksector_write = bytes_to_sectors(disk_write, self.block_size, self.use_ceiling)
+        
+        boot_exec = np.arange(self.n_rows, self.n_rows + n) == 0
+        self.n_rows += n
+        return blocksector_read, blocksector_write, boot_exec
+
+
+def npy_header(dtype, n_records, size=0):
+    """
+    Header of a .npy file (format version 1.0) holding n_records records of
+    dtype, padded to at least size bytes. A header written for the largest
+    possible count can later be overwritten in place with the real count.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(dtype), n_records)
+    # Magic string, version and header length come first, and the data
+    # starts at a multiple of 64 bytes
+    size = max(size, -(-(10 + len(header) + 1) // 64) * 64)
+    header = header.ljust(size - 11) + '\n'
+    return np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def convert_monitoring_data_streaming(input_csv, output_path='blocksector_format.csv',
+        method='smart', block_size=None, chunk_size=100000):
+    """
+    Convert OpenEuler monitoring data to blocksector format chunk by chunk,
+    in memory bounded by the chunk size. The output is the same as that of
+    the matching conversion above.
+    
+    Parameters:
+    - input_csv: Path to the OpenEuler monitoring CSV file
+    - output_path: Path for the output, a CSV file, or a binary trace for
+      DataLoaderPintos if it ends with .npy
+    - method, block_size: Conversion, see SectorConverter
+    - chunk_size: Metrics rows converted at a time
+    """
+    
+    from cache.DataLoader import TRACE_DTYPE
+    
+    converter = SectorConverter(method, block_size)
+    binary = output_path.endswith('.npy')
+    n_records = 0
+    
+    with open(output_path, 'wb' if binary else 'w', newline=None if binary else '') as out:
+        # The record count is only known at the end: reserve room for any
+        # count, and write the real header over it once done
+        if binary:
+            header = npy_header(TRACE_DTYPE, np.iinfo(np.int64).max)
+            out.write(header)
+        chunks = pd.read_csv(input_csv, usecols=['disk_read', 'disk_write'],
+            chunksize=max(chunk_size, 100))
+        for chunk in chunks:
+            blocksector_read, blocksector_write, boot_exec = converter.convert(
+                chunk['disk_read'].to_numpy(), chunk['disk_write'].to_numpy())
+            output_df = interleave_operations(blocksector_read, blocksector_write, boot_exec)
+            if binary:
+                records = np.empty(len(output_df), dtype=TRACE_DTYPE)
+                for name in TRACE_DTYPE.names:
+                    records[name] = output_df[name].to_numpy()
+                out.write(records.tobytes())
+            else:
+                output_df.to_csv(out, index=False, header=n_records == 0)
+            n_records += len(output_df)
+        if binary:
+            out.seek(0)
+            out.write(npy_header(TRACE_DTYPE, n_records, len(header)))
+    
+    print(f"Converted {converter.n_rows} rows into {n_records} records ({method})")
+    print(f"Output saved to: {output_path}")
+    
+    return n_records
+
+
 # Usage example:
 if __name__ == "__main__":
     input_file = 'metrics (3).csv'
@@ -212,4 +301,8 @@ if __name__ == "__main__":
     # print("\n" + "="*60)
     # print("METHOD 3: Cumulative sector addressing")
     # print("="*60)
-    # df3 = convert_with_cumulative_sectors(input_file, 'blocksector_format_cumulative.csv')
\ No newline at end of file
+    # df3 = convert_with_cumulative_sectors(input_file, 'blocksector_format_cumulative.csv')
+
+    # For captures too large to fit in memory, convert chunk by chunk:
+    # convert_monitoring_data_streaming(input_file, 'blocksector_format.csv', method='smart')
+    # convert_monitoring_data_streaming(input_file, 'blocksector_format.npy', method='cumulative')
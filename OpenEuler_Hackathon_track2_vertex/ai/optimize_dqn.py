@@ -22,7 +22,7 @@ warnings.filterwarnings('ignore')
 from cache.Cache import Cache
 from agents.DQNAgent import DQNAgent
 from agents.ReflexAgent import RandomAgent, LRUAgent, LFUAgent, MRUAgent
-from cache.DataLoader import DataLoaderPintos
+from cache.DataLoader import DataLoaderPintos, DataLoaderSampled, scale_cache_size
 
 
 class DQNCacheOptimizer:
@@ -40,7 +40,8 @@ class DQNCacheOptimizer:
         study_name: str = "dqn_cache_optimization",
         storage: Optional[str] = None,
         feature_selection: tuple = ('Base',),
-        reward_params: dict = None
+        reward_params: dict = None,
+        sample_rate: Optional[float] = None
     ):
         """
         Initialize the optimizer.
@@ -55,6 +56,8 @@ class DQNCacheOptimizer:
             storage: Database URL for distributed optimization
             feature_selection: Feature selection for cache environment
             reward_params: Reward parameters for cache environment
+            sample_rate: If set, trials run on a spatially sampled trace with
+                a cache scaled by this rate, trading accuracy for speed
         """
         self.file_paths = file_paths
         self.cache_size = cache_size
@@ -64,6 +67,10 @@ class DQNCacheOptimizer:
         self.study_name = study_name
         self.storage = storage
         self.feature_selection = feature_selection
+        self.sample_rate = sample_rate
+        # Fail now rather than in every trial on a rate that biases the estimate
+        if sample_rate:
+            scale_cache_size(cache_size, sample_rate)
         
         if reward_params is None:
             self.reward_params = dict(
@@ -100,9 +107,13 @@ class DQNCacheOptimizer:
             try:
                 # Create environment
                 dataloader = DataLoaderPintos(path)
+                cache_size = self.cache_size
+                if self.sample_rate:
+                    dataloader = DataLoaderSampled(dataloader, self.sample_rate)
+                    cache_size = dataloader.scale_cache_size(cache_size)
                 env = Cache(
                     dataloader,
-                    self.cache_size,
+                    cache_size,
                     feature_selection=self.feature_selection,
                     reward_params=self.reward_params,
                     allow_skip=False
@@ -135,7 +146,7 @@ class DQNCacheOptimizer:
                 step = 0
                 
                 for episode in range(self.n_episodes):
-                    observation = env.reset()
+                    observation = env.reset(agent.required_fields)
                     
                     while True:
                         # Agent choose action
@@ -1,4 +1,4 @@
-import sys, os
+import sys, os, time
 import numpy as np
 import json
 from datetime import datetime
@@ -6,7 +6,8 @@ from cache.Cache import Cache
 from agents.CacheAgent import *
 from agents.DQNAgent import DQNAgent
 from agents.ReflexAgent import *
-from cache.DataLoader import DataLoaderPintos
+from cache.DataLoader import DataLoaderPintos, DataLoaderSampled
+from cache.Replay import simulate, estimate_miss_rate, REPLAY_POLICIES
 from optimize_dqn import DQNCacheOptimizer
 
 def run_optimization(file_paths, cache_size=50):
@@ -52,15 +53,22 @@ def run_optimization(file_paths, cache_size=50):
     return study
 
 
-def run_evaluation(file_paths, cache_size=50, use_optimized=False, params_file="best_dqn_params.json"):
+def run_evaluation(file_paths, cache_size=50, use_optimized=False, params_file="best_dqn_params.json", profile=False,
+        sample_rate=None, n_samples=4):
     """
     Evaluate agents on test datasets.
     
     Args:
-        file_paths: List of dataset file paths
+        file_paths: List of dataset file paths. An entry can also be a list of
+            paths, evaluated as one trace with a miss rate per program
         cache_size: Size of the cache
         use_optimized: Whether to use optimized hyperparameters
         params_file: Path to optimized parameters file
+        profile: Whether to add per-phase simulator timings to results.json
+        sample_rate: If set, estimate miss rates on a spatially sampled trace
+            with a cache scaled by this rate, see DataLoaderSampled
+        n_samples: Number of samples the classic policies are estimated on,
+            giving the sampling standard error of their estimates
     """
     print("\n" + "="*80)
     print("EVALUATING AGENTS")
@@ -70,15 +78,27 @@ def run_evaluation(file_paths, cache_size=50, use_optimized=False, params_file="
     results_json = []
     
     for path in file_paths:
-        case_name = os.path.basename(path)
+        progs = [path] if isinstance(path, str) else list(path)
+        case_name = "+".join(os.path.basename(prog) for prog in progs)
         print("==================== Testcase %s ====================" % case_name)
 
         # cache
-        dataloader = DataLoaderPintos(path)
-        env = Cache(dataloader, cache_size
+        trace = DataLoaderPintos(progs)
+        # Per-program miss rates, unless sampled (programs are not kept apart)
+        per_program = len(progs) > 1 and not sample_rate
+        if sample_rate:
+            dataloader = DataLoaderSampled(trace, sample_rate)
+            env_cache_size = dataloader.scale_cache_size(cache_size)
+            print("Sampled %d of %d requests, cache size %d"
+                % (len(dataloader.get_requests()), len(trace.get_requests()), env_cache_size))
+        else:
+            dataloader = trace
+            env_cache_size = cache_size
+        env = Cache(dataloader, env_cache_size
             , feature_selection=('Base',)
             , reward_params = dict(name='our', alpha=0.5, psi=10, mu=1, beta=0.3)
             , allow_skip=False
+            , profiling=profile
         )
         
         # agents
@@ -119,11 +139,17 @@ def run_evaluation(file_paths, cache_size=50, use_optimized=False, params_file="
         agents['LRU'] = LRUAgent(env.n_actions)
         agents['LFU'] = LFUAgent(env.n_actions)
         agents['MRU'] = MRUAgent(env.n_actions)
+        # Offline optimum, the lower bound of the miss rate
+        agents['Belady'] = BeladyAgent(env.n_actions)
     
         for (name, agent) in agents.items():
             print("-------------------- %s --------------------" % name)
+            start_time = time.perf_counter()
             step = 0
             miss_rates = []    # record miss rate for every episode
+            errors = []        # and its sampling standard error if sampled
+            program_miss_rates = []
+            replay = [0, 0.0]  # calls and wall time of replayed episodes
             
             # determine how many episodes to proceed
             # 100 for learning agents, 20 for random agents
@@ -136,37 +162,59 @@ def run_evaluation(file_paths, cache_size=50, use_optimized=False, params_file="
                 episodes = 1
 
             for episode in range(episodes):
-                # initial observation
-                observation = env.reset()
+                # Classic policies replay the whole trace without stepping the env
+                if name in REPLAY_POLICIES and not env.allow_skip:
+                    replay_start = time.perf_counter()
+                    if sample_rate:
+                        mr, error = estimate_miss_rate(trace, cache_size, name, sample_rate, n_samples)
+                        print("Agent=%s, Case=%s, Episode=%d: MissRate=%f, SamplingStdErr=%f (sampled)"
+                            % (name, case_name, episode, mr, error)
+                        )
+                        miss_rates.append(mr)
+                        errors.append(error)
+                        replay[0] += 1
+                        replay[1] += time.perf_counter() - replay_start
+                        continue
+                    program_misses, program_accesses = simulate(dataloader, cache_size, name, per_program=True)
+                    misses, accesses = int(program_misses.sum()), int(program_accesses.sum())
+                    program_miss_rates.append(program_misses / np.maximum(program_accesses, 1))
+                    replay[0] += 1
+                    replay[1] += time.perf_counter() - replay_start
+                else:
+                    # initial observation
+                    observation = env.reset(agent.required_fields)
+
+                    while True:
+                        # agent choose action based on observation
+                        action = agent.choose_action(observation)
 
-                while True:
-                    # agent choose action based on observation
-                    action = agent.choose_action(observation)
+                        # agent take action and get next observation and reward
+                        observation_, reward = env.step(action)
 
-                    # agent take action and get next observation and reward
-                    observation_, reward = env.step(action)
+                        # break while loop when end of this episode
+                        if env.hasDone():
+                            break
 
-                    # break while loop when end of this episode
-                    if env.hasDone():
-                        break
+                        agent.store_transition(observation, action, reward, observation_)
 
-                    agent.store_transition(observation, action, reward, observation_)
+                        if isinstance(agent, LearnerAgent) and (step > 20) and (step % 5 == 0):
+                            agent.learn()
 
-                    if isinstance(agent, LearnerAgent) and (step > 20) and (step % 5 == 0):
-                        agent.learn()
+                        # swap observation
+                        observation = observation_
 
-                    # swap observation
-                    observation = observation_
+                        if step % 100 == 0:
+                            mr = env.miss_rate()
 
-                    if step % 100 == 0:
-                        mr = env.miss_rate()
+                        step += 1
 
-                    step += 1
+                    accesses, misses = env.total_count, env.miss_count
+                    program_miss_rates.append(env.program_miss_rates())
 
                 # report after every episode
-                mr = env.miss_rate()
+                mr = misses / accesses
                 print("Agent=%s, Case=%s, Episode=%d: Accesses=%d, Misses=%d, MissRate=%f"
-                    % (name, case_name, episode, env.total_count, env.miss_count, mr)
+                    % (name, case_name, episode, accesses, misses, mr)
                 )
                 miss_rates.append(mr)
 
@@ -179,10 +227,29 @@ def run_evaluation(file_paths, cache_size=50, use_optimized=False, params_file="
             )
             
             # Store simplified result for JSON (multiply by 100 to get percentage)
-            results_json.append({
+            result = {
                 "algorithm": name,
                 "miss_rate": round(mean_mr * 100, 2)
-            })
+            }
+            # Spread of the samples only, not the bias of sampling, and none
+            # for the policies sampling biases, see estimate_miss_rate()
+            if errors and not np.isnan(errors).any():
+                result["miss_rate_sampling_stderr"] = round(float(np.mean(errors)) * 100, 2)
+            if per_program:
+                program_mean = np.nan_to_num(np.mean(program_miss_rates, axis=0))
+                for prog, mr in zip(progs, program_mean):
+                    print("Agent=%s, Program=%s: MissRate=%f" % (name, prog, mr))
+                result["programs"] = [{"program": prog, "miss_rate": round(float(mr) * 100, 2)}
+                    for prog, mr in zip(progs, program_mean)]
+            # Simulator phases vs. the whole run, the rest being the agent.
+            # Replayed policies never step the env, their only phase is the replay.
+            if profile:
+                phases = env.profile(clear=True)
+                if replay[0]:
+                    phases = dict(replay=dict(calls=replay[0], seconds=replay[1]))
+                result["profile"] = phases
+                result["profile"]["total_seconds"] = time.perf_counter() - start_time
+            results_json.append(result)
             
             # Clean up DQN agent
             if name == 'DQN':